@@ -0,0 +1,283 @@
+"""
+Benchmarks of the motion, speed lookup and calibration hot paths.
+The servo runs on the simulated PWM backend, so the benchmarks work on any computer.
+
+    python run_benchmarks.py                  # run and compare with baseline.json if it exists
+    python run_benchmarks.py --save-baseline  # run and save the results as the new baseline
+
+The results are written in results.json. The exit code is 1 if a metric is worse than the baseline
+by more than the tolerance. The step jitter depends on the scheduler of the OS, it is reported but never fails.
+The baseline keeps the slowest value of each metric over several runs, the upper end of the noise of the machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+from time import perf_counter, sleep
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORE = os.path.join(ROOT, "core_run_raspberry_pi")
+CALIBRATION = os.path.join(ROOT, "calibrate_speed")
+sys.path[:0] = [CORE, CALIBRATION]
+
+from pwm_backend import SimulatedBackend  # noqa: E402
+from servo_motor import ServoController  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PATH_RESULTS = os.path.join(HERE, "results.json")
+PATH_BASELINE = os.path.join(HERE, "baseline.json")
+
+SERVO_NAMES = ["servo_sg9", "servo_s53_20"]
+
+# the per-step timings of the motion loop are a few µs: an absolute margin on top of the relative tolerance
+STEP_MARGIN_S = 5e-5
+# metrics reported without being compared
+INFORMATIONAL = ("_step_jitter_s",)
+
+
+def load_conf() -> dict:
+    """ servo configs of the controller """
+    with open(os.path.join(CORE, "params", "servo_params.json")) as infile:
+        return json.load(infile)
+
+
+def bench_motion(conf: dict, nb_runs: int = 15) -> dict:
+    """
+    per-step overhead and jitter of go_to_position against the simulated PWM, for both scheduling modes:
+    median over nb_runs full-range moves.
+    In sleep mode, the overshoot of a bare sleep loop measured after each move is subtracted from the overhead,
+    so the metric is the cost of the loop itself and not the noise of the OS scheduler
+    """
+    results = {}
+    for scheduling in ("sleep", "deadline"):
+        backend = SimulatedBackend()
+        # without the latency compensation, the overhead measured is the one of the loop itself
+        servo = ServoController(signal_pin=2, backend=backend, scheduling=scheduling,
+                                **{**conf["servo_sg9"], "step_overhead_s": None})
+        servo.go_to_position(angle=-90, percent_speed=100)
+
+        channel = backend.channels[2]
+        overheads = []
+        jitters = []
+        for run_index in range(nb_runs):
+            channel.reset()
+            waiting_time, _ = servo.go_to_position(angle=90 if run_index % 2 == 0 else -90, percent_speed=100)
+
+            intervals = channel.intervals()
+            overhead = statistics.mean(intervals) - waiting_time
+            if scheduling == "sleep":
+                overhead -= sleep_overshoot(waiting_time, len(intervals))
+            overheads.append(overhead)
+            jitters.append(statistics.pstdev(intervals))
+
+        results[f"go_to_position_{scheduling}_step_overhead_s"] = statistics.median(overheads)
+        results[f"go_to_position_{scheduling}_step_jitter_s"] = statistics.median(jitters)
+        servo.release()
+
+    return results
+
+
+def sleep_overshoot(waiting_time: float, nb_steps: int) -> float:
+    """ mean time in seconds a bare sleep(waiting_time) lasts longer than asked on this host """
+    start = perf_counter()
+    for _ in range(nb_steps):
+        sleep(waiting_time)
+    return (perf_counter() - start) / nb_steps - waiting_time
+
+
+def reference_loop(nb_iterations: int = 20000) -> float:
+    """ time in seconds of a fixed pure Python loop, the unit of the relative metrics """
+    start = perf_counter()
+    total = 0.
+    for i in range(nb_iterations):
+        total += i * 0.5
+    return perf_counter() - start
+
+
+def measure(function: Callable[[], None], nb_runs: int) -> tuple:
+    """
+    run function nb_runs times, each run between two runs of the reference loop.
+    The speed of this machine changes between runs and within a run: the time relative to the reference loop
+    measured around it is much steadier than the time itself, it is the value compared with the baseline
+    :return: median time in seconds, median time relative to the reference loop
+    """
+    times = []
+    ratios = []
+    for _ in range(nb_runs):
+        before = reference_loop()
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        after = reference_loop()
+
+        times.append(elapsed)
+        ratios.append(elapsed * 2 / (before + after))
+
+    return statistics.median(times), statistics.median(ratios)
+
+
+def bench_lookup(conf: dict, nb_calls: int = 20000, nb_runs: int = 15) -> tuple:
+    """ time of one call of _get_variable_set and _angle_to_duty, see measure """
+    servo = ServoController(signal_pin=2, backend=SimulatedBackend(), **conf["servo_sg9"])
+    percents = [i % 101 for i in range(nb_calls)]
+    angles = [i % 181 - 90 for i in range(nb_calls)]
+
+    get_variable_set = servo._get_variable_set
+    angle_to_duty = servo._angle_to_duty
+
+    def run_variable_set():
+        for percent_speed in percents:
+            get_variable_set(percent_speed)
+
+    def run_angle_to_duty():
+        for angle in angles:
+            angle_to_duty(angle)
+
+    results = {}
+    relative = {}
+    for name, function in (("get_variable_set_call_s", run_variable_set),
+                           ("angle_to_duty_call_s", run_angle_to_duty)):
+        elapsed, relative[name] = measure(function, nb_runs)
+        results[name] = elapsed / nb_calls
+
+    return results, relative
+
+
+def bench_calibration(nb_runs: int = 30, nb_calls_clean: int = 200) -> tuple:
+    """ end-to-end time of build_params and clean_up_parameters on the bundled acquisition data, see measure """
+    import create_speed_config
+
+    results = {}
+    relative = {}
+    for name_servo in SERVO_NAMES:
+        df = create_speed_config.load_data(
+            os.path.join(CALIBRATION, "data", f"time_analysis_raspberry_3_{name_servo}.csv"), 600)
+
+        outputs = {}
+
+        def run_build():
+            with contextlib.redirect_stdout(io.StringIO()):
+                outputs["params"] = create_speed_config.build_params(
+                    df=df, min_mae=0.9, max_speed_servo_specs=600, plot_graph=False)
+
+        def run_clean():
+            # a single call lasts a few µs: timed over several calls
+            parameters, max_speed_all, min_speed_all = outputs["params"]
+            for _ in range(nb_calls_clean):
+                create_speed_config.clean_up_parameters(
+                    parameters=parameters, max_speed_all=max_speed_all, min_speed_all=min_speed_all)
+
+        name_build = f"build_params_{name_servo}_s"
+        results[name_build], relative[name_build] = measure(run_build, nb_runs)
+
+        name_clean = f"clean_up_parameters_{name_servo}_s"
+        elapsed, relative[name_clean] = measure(run_clean, nb_runs)
+        results[name_clean] = elapsed / nb_calls_clean
+
+    return results, relative
+
+
+def compare(results: dict, baseline: dict, tolerance: float, step_margin: float = STEP_MARGIN_S) -> list:
+    """
+    compare the metrics with the baseline, every metric is a time: lower is better.
+    The CPU-bound metrics are compared by their time relative to the reference loop, see measure
+    :param step_margin: absolute margin in seconds of the per-step metrics of the motion loop
+    :return: description of each regression
+    """
+    regressions = []
+    for name, value in results["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if reference is None:
+            continue
+
+        if name.endswith(INFORMATIONAL):
+            print(f"{'info':>10} {name}: {value:.3e} (baseline {reference:.3e})")
+            continue
+
+        if name in results["relative"] and name in baseline.get("relative", {}):
+            relative, relative_reference = results["relative"][name], baseline["relative"][name]
+            regression = relative > relative_reference * (1 + tolerance)
+            detail = f"relative {relative:.3e}, baseline {relative_reference:.3e}"
+        else:
+            # overheads can be close to 0, so an absolute margin avoids false alarms
+            regression = value > reference * (1 + tolerance) + step_margin
+            detail = f"baseline {reference:.3e}"
+
+        status = "REGRESSION" if regression else "ok"
+        print(f"{status:>10} {name}: {value:.3e} ({detail})")
+        if regression:
+            regressions.append(name)
+
+    return regressions
+
+
+def run_all(conf: dict) -> dict:
+    """ run every benchmark """
+    metrics = bench_motion(conf)
+    metrics_lookup, relative = bench_lookup(conf)
+    metrics.update(metrics_lookup)
+    try:
+        metrics_calibration, relative_calibration = bench_calibration()
+        metrics.update(metrics_calibration)
+        relative.update(relative_calibration)
+    except ImportError as error:
+        print(f"calibration benchmarks skipped: {error}")
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "metrics": metrics,
+        "relative": relative,
+    }
+    return results
+
+
+def run():
+    """ core method to run the benchmarks """
+    parser = argparse.ArgumentParser(description="benchmarks of the servo hot paths")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown accepted before a metric is a regression")
+    parser.add_argument("--step-margin", type=float, default=STEP_MARGIN_S,
+                        help="absolute margin in seconds of the per-step metrics of the motion loop")
+    parser.add_argument("--baseline-runs", type=int, default=3,
+                        help="number of runs of the benchmarks to save the baseline")
+    args = parser.parse_args()
+
+    conf = load_conf()
+    results = run_all(conf)
+
+    with open(PATH_RESULTS, 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+
+    if args.save_baseline:
+        for _ in range(args.baseline_runs - 1):
+            other = run_all(conf)
+            for key in ("metrics", "relative"):
+                results[key] = {name: max(value, other[key][name]) for name, value in results[key].items()}
+
+        with open(PATH_BASELINE, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+        print(f"baseline saved in {PATH_BASELINE}")
+        return
+
+    if not os.path.exists(PATH_BASELINE):
+        for name, value in results["metrics"].items():
+            print(f"{name}: {value:.3e}")
+        print("no baseline to compare with, run with --save-baseline")
+        return
+
+    with open(PATH_BASELINE) as infile:
+        baseline = json.load(infile)
+
+    if compare(results, baseline, args.tolerance, args.step_margin):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
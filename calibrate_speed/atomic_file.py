@@ -0,0 +1,22 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w"):
+    """
+    open a file that replaces path atomically, a reader never sees a partial file.
+    It is written next to path under a unique temporary name, renamed to path at the end of the with block,
+    and removed if the block raises
+    :param path: file to replace
+    :param mode: "w" or "wb"
+    """
+    fd, path_tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as outfile:
+            yield outfile
+        os.replace(path_tmp, path)
+    except BaseException:
+        os.remove(path_tmp)
+        raise
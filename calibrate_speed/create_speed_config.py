@@ -1,11 +1,16 @@
+import argparse
 import json
-from typing import Optional
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from typing import TYPE_CHECKING, Optional
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-from scipy.optimize import minimize
-from sklearn.metrics import mean_squared_error, mean_absolute_error
+
+from atomic_file import atomic_open
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def load_json(path: str) -> dict:
@@ -18,9 +23,9 @@ def load_json(path: str) -> dict:
 
 def save_json(path: str, json_to_save: dict) -> None:
     """
-    save json format file
+    save json format file, atomically
     """
-    with open(path, 'w') as outfile:
+    with atomic_open(path) as outfile:
         json.dump(json_to_save, outfile, indent=4)
 
 
@@ -29,15 +34,10 @@ def model(params: list, x: list) -> list:
     return params[0] / x + params[1]
 
 
-def mse(params: list, x: list, y: list) -> float:
-    """ mean squared error calculation between the real values and the calculated values"""
-    y_p = model(params, x)
-
-    return mean_squared_error(y, y_p)
-
-
 def plot(x: list, y: list, y_p: list) -> None:
     """ plot a 2D graph """
+    import matplotlib.pyplot as plt
+
     fig = plt.figure()
     ax = fig.add_subplot()
 
@@ -54,6 +54,8 @@ def plot(x: list, y: list, y_p: list) -> None:
 
 def plot_3d(x: list, y: list, y_p: list) -> None:
     """ plot a 3D graph """
+    import matplotlib.pyplot as plt
+
     fig = plt.figure()
     ax = fig.add_subplot(projection='3d')
 
@@ -75,15 +77,47 @@ def plot_3d(x: list, y: list, y_p: list) -> None:
     plt.show()
 
 
-def regression(x: np.array, y: np.array, params_model: list) -> Optional[tuple]:
-    """ minimize the mean squared error between the real values and the predicted values"""
-    try:
-        res = minimize(mse, np.array(params_model), args=(x, y), tol=1e-3)
-        y_p = model(res.x, x)
-        mae = mean_absolute_error(y, y_p)
-        return res, y_p, mae
-    except Exception:
-        return None, None, None
+def sample_weights(x: np.ndarray) -> np.ndarray:
+    """
+    weight of each sample: the span of waiting time it represents, half the distance to each neighbour.
+    All the weights are equal for the regular grid of a full sweep, so they only matter for an adaptive sweep,
+    where the samples are denser in some places
+    """
+    if len(x) < 2:
+        return np.ones(len(x))
+
+    weights = np.empty(len(x))
+    weights[1:-1] = np.abs(x[:-2] - x[2:]) / 2
+    weights[0] = abs(x[0] - x[1])
+    weights[-1] = abs(x[-2] - x[-1])
+
+    return weights / weights.mean()
+
+
+def fit_truncations(x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    weighted least squares fit of the model on every truncation x[:k], y[:k] of the samples at once.
+    The model is linear in its parameters, so each fit is closed form and computed from prefix sums.
+    :return: parameters of each fit (row k - 1 for the first k samples) and mean absolute error of each fit
+    """
+    u = 1 / x
+    w = sample_weights(x)
+
+    sum_w = np.cumsum(w)
+    sum_u = np.cumsum(w * u)
+    sum_uu = np.cumsum(w * u * u)
+    sum_y = np.cumsum(w * y)
+    sum_uy = np.cumsum(w * u * y)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        param_a = (sum_w * sum_uy - sum_u * sum_y) / (sum_w * sum_uu - sum_u ** 2)
+        param_b = (sum_y - param_a * sum_u) / sum_w
+
+        # error of every sample for every fit, fit k only counts its first k samples
+        errors = w[None, :] * np.abs(y[None, :] - (param_a[:, None] * u[None, :] + param_b[:, None]))
+        mae = np.where(np.tri(len(x), dtype=bool), errors, 0).sum(axis=1) / sum_w
+
+    return np.column_stack([param_a, param_b]), mae
 
 
 def clean_up_parameters(parameters: dict, max_speed_all: float, min_speed_all: float) -> dict:
@@ -132,14 +166,54 @@ def clean_up_parameters(parameters: dict, max_speed_all: float, min_speed_all: f
     return clean_parameters
 
 
-def build_params(df: pd.DataFrame, init_params_model: list, min_mae: float,
-                 max_speed_servo_specs: int, plot_graph: bool = True) -> tuple:
-    """ do the regression and save the parameters in a config"""
+def fit_step(x: np.ndarray, y: np.ndarray, min_mae: float) -> Optional[tuple]:
+    """
+    fit the samples of one step.
+    The longest series of samples (at least 4) fitted with a mean absolute error below min_mae is kept.
+    :return: number of samples kept, parameters of the model, mean absolute error. None if no fit is good enough
+    """
+    params, mae = fit_truncations(x=x, y=y)
+
+    valid = np.flatnonzero(mae[3:] <= min_mae)
+    if not len(valid):
+        return None
+
+    length = valid[-1] + 4
+    return length, params[length - 1], mae[length - 1]
+
+
+def step_overhead(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    time in seconds added to each waiting time by the loop of the acquisition host (ChangeDutyCycle, sleep overshoot).
+    The servo follows each step, so 1 / speed = (waiting_time + overhead) / degrees per step, linear in the waiting time
+    """
+    slope, intercept = np.polyfit(x, 1 / y, 1)
+    return float(max(intercept / slope, 0.)) / 1000
+
+
+def step_config(y: np.ndarray, params: np.ndarray, mae: float, overhead: float) -> dict:
+    """ speed config entry of one step """
+    return {
+        "min_speed": round(y.min(), 2),
+        "max_speed": round(y.max(), 2),
+        "params": [float(param) for param in params],
+        "mae": f"{round(mae, 4)} degree/s",
+        "overhead_s": round(overhead, 7)
+    }
+
+
+def speed_limits(parameters: dict, max_speed_servo_specs: int) -> tuple:
+    """ maximum and minimum speeds reached by the fitted steps """
+    max_speed_all = max((value["max_speed"] for value in parameters.values()), default=0)
+    min_speed_all = min((value["min_speed"] for value in parameters.values()), default=max_speed_servo_specs)
+    return max_speed_all, min_speed_all
+
+
+def build_params(df: "pd.DataFrame", min_mae: float, max_speed_servo_specs: int, plot_graph: bool = True) -> tuple:
+    """ do the regression and save the parameters in a config """
 
     values = []
     parameters = {}
-    min_speed_all = max_speed_servo_specs
-    max_speed_all = 0
 
     for i in df["steps"].unique():
         print(f"step: {i}")
@@ -147,66 +221,78 @@ def build_params(df: pd.DataFrame, init_params_model: list, min_mae: float,
         x = val["waiting_time(ms)"].to_numpy()
         y = val["rotation_speed(°/s)"].to_numpy()
 
-        res, y_p, mae = regression(x=x, y=y, params_model=init_params_model)
-        mae = min_mae + 1 if mae is None else mae
-
-        while mae > min_mae:
-            x = x[:-1]
-            y = y[:-1]
-
-            res, y_p, mae = regression(x=x, y=y, params_model=init_params_model)
-            is_none = mae
-            mae = min_mae - 1 if mae is None else mae
-
-            if is_none is None or mae > min_mae or len(x) <= 3:
-                continue
+        fit = fit_step(x=x, y=y, min_mae=min_mae)
+        if fit is None:
+            continue
 
-            min_speed = y.min()
-            max_speed = y.max()
-            min_speed_all = round(min(min_speed_all, min_speed), 2)
-            max_speed_all = round(max(max_speed_all, max_speed), 2)
+        length, res, mae = fit
+        x = x[:length]
+        y = y[:length]
+        y_p = model(res, x)
 
-            parameters[int(i)] = {
-                "min_speed": round(min_speed, 2),
-                "max_speed": round(max_speed, 2),
-                "params": list(res.x),
-                "mae": f"{round(mean_absolute_error(y, y_p), 4)} degree/s"
-            }
+        parameters[int(i)] = step_config(y=y, params=res, mae=mae, overhead=step_overhead(x, y))
 
-            values.extend([[i, x[ind - 1], y[ind - 1], y_p[ind - 1]] for ind in range(1, len(x) + 1)])
-            # plot(x, y, y_p)
+        values.extend([[i, x[ind - 1], y[ind - 1], y_p[ind - 1]] for ind in range(1, len(x) + 1)])
+        # plot(x, y, y_p)
 
     if plot_graph:
         values = np.array(values)
         plot_3d([values[:, 0], values[:, 1]], values[:, 2], values[:, 3])
 
+    max_speed_all, min_speed_all = speed_limits(parameters, max_speed_servo_specs)
     return parameters, max_speed_all, min_speed_all
 
 
+def servo_config(config_analysis: dict, name_servo: str, clean_parameters: dict,
+                 min_speed_all: float, max_speed_all: float) -> dict:
+    """ final config of a servo built from its acquisition config """
+    config = dict(config_analysis[name_servo])
+
+    config["speed_config"] = clean_parameters
+    del config["min_sleep_s"]
+    del config["max_sleep_s"]
+
+    config["min_speed_d_s"] = min_speed_all
+    config["max_speed_d_s"] = max_speed_all
+
+    # per-step overhead of the acquisition host, used by the latency compensation of ServoController
+    overheads = sorted(value["overhead_s"] for value in clean_parameters.values() if "overhead_s" in value)
+    if overheads:
+        config["step_overhead_s"] = overheads[len(overheads) // 2]
+
+    return config
+
+
 def save_params(name_servo: str, clean_parameters: dict, path_config_load: str, path_config_saves: list,
                 min_speed_all: float, max_speed_all: float):
     """ override the parameters """
-    config_analysis = load_json(path_config_load)
-
-    config_analysis[name_servo]["speed_config"] = clean_parameters
-    del config_analysis[name_servo]["min_sleep_s"]
-    del config_analysis[name_servo]["max_sleep_s"]
-
-    config_analysis[name_servo]["min_speed_d_s"] = min_speed_all
-    config_analysis[name_servo]["max_speed_d_s"] = max_speed_all
+    config = servo_config(
+        config_analysis=load_json(path_config_load), name_servo=name_servo, clean_parameters=clean_parameters,
+        min_speed_all=min_speed_all, max_speed_all=max_speed_all)
 
     for path_config_save in path_config_saves:
         config_final = load_json(path_config_save)
-        config_final[name_servo] = config_analysis[name_servo]
+        config_final[name_servo] = config
 
         save_json(path=path_config_save, json_to_save=config_final)
 
 
+def load_data(path: str, max_speed_servo_specs: int) -> "pd.DataFrame":
+    """ load the results of the data acquisition """
+    import pandas as pd
+
+    df = pd.read_csv(path)
+
+    df = df[df["rotation_speed(°/s)"] <= max_speed_servo_specs]
+    df["waiting_time(ms)"] = df["waiting_time(s)"] * 1000
+
+    return df
+
+
 def run():
     """ core method to perform the analysis """
 
     name_servo = "servo_sg9"
-    init_params_model = [24.36093280680071, 3.6269641385313385]
     max_speed_servo_specs = 600
     min_mae = 0.9
 
@@ -216,14 +302,11 @@ def run():
         "./run_for_data_visualization/params/servo_params.json"
     ]
 
-    df = pd.read_csv(f"data/time_analysis_raspberry_3_{name_servo}.csv")
-
-    df = df[df["rotation_speed(°/s)"] <= max_speed_servo_specs]
-    df["waiting_time(ms)"] = df["waiting_time(s)"] * 1000
+    df = load_data(f"data/time_analysis_raspberry_3_{name_servo}.csv", max_speed_servo_specs)
 
     parameters, max_speed_all, min_speed_all = \
         build_params(
-            df=df, init_params_model=init_params_model, min_mae=min_mae,
+            df=df, min_mae=min_mae,
             max_speed_servo_specs=max_speed_servo_specs, plot_graph=True
         )
 
@@ -236,5 +319,120 @@ def run():
         path_config_saves=path_config_saves, min_speed_all=min_speed_all, max_speed_all=max_speed_all)
 
 
+def run_fits(path_fits: str):
+    """
+    save the speed configs fitted during the data acquisition, without loading and fitting the csv files.
+    :param path_fits: provisional speed configs written by run_for_data_acquisition, servo name -> step -> config
+    """
+    max_speed_servo_specs = 600
+
+    path_config_load = "./run_for_data_acquisition/params/servo_params.json"
+    path_config_saves = [
+        "../core_run_raspberry_pi/params/servo_params.json",
+        "./run_for_data_visualization/params/servo_params.json"
+    ]
+
+    for name_servo, servo_parameters in load_json(path_fits).items():
+        parameters = {int(step): config for step, config in servo_parameters.items()}
+        if not parameters:
+            print(f"{name_servo}: no step fitted")
+            continue
+
+        max_speed_all, min_speed_all = speed_limits(parameters, max_speed_servo_specs)
+        clean_parameters = clean_up_parameters(
+            parameters=parameters, max_speed_all=max_speed_all, min_speed_all=min_speed_all)
+
+        save_params(
+            name_servo=name_servo, clean_parameters=clean_parameters, path_config_load=path_config_load,
+            path_config_saves=path_config_saves, min_speed_all=min_speed_all, max_speed_all=max_speed_all)
+        print(f"{name_servo}: steps {list(clean_parameters)}")
+
+
+def _fit_step_job(job: tuple) -> tuple:
+    """ fit one step of one servo, run in a worker process """
+    name_servo, step, x, y, min_mae = job
+
+    fit = fit_step(x=x, y=y, min_mae=min_mae)
+    if fit is None:
+        return name_servo, step, None
+
+    length, res, mae = fit
+    return name_servo, step, step_config(
+        y=y[:length], params=res, mae=mae, overhead=step_overhead(x[:length], y[:length]))
+
+
+def run_batch(workers: Optional[int] = None):
+    """
+    fit every servo that has a time_analysis_*.csv file in data/, all steps in parallel in a process pool.
+    Each config file is written once, atomically, with every servo updated
+    :param workers: number of processes, the number of CPUs by default
+    """
+    max_speed_servo_specs = 600
+    min_mae = 0.9
+
+    path_config_load = "./run_for_data_acquisition/params/servo_params.json"
+    path_config_saves = [
+        "../core_run_raspberry_pi/params/servo_params.json",
+        "./run_for_data_visualization/params/servo_params.json"
+    ]
+
+    config_analysis = load_json(path_config_load)
+
+    jobs = []
+    for path in sorted(glob("data/time_analysis_*.csv")):
+        file_name = os.path.splitext(os.path.basename(path))[0]
+        name_servo = next((name for name in config_analysis if file_name.endswith(name)), None)
+        if name_servo is None:
+            print(f"no servo config for {path}, skipped")
+            continue
+
+        df = load_data(path, max_speed_servo_specs)
+        for step in df["steps"].unique():
+            val = df[df["steps"] == step]
+            jobs.append((name_servo, int(step), val["waiting_time(ms)"].to_numpy(),
+                         val["rotation_speed(°/s)"].to_numpy(), min_mae))
+
+    # keep the order of the steps in the data files, as in build_params
+    parameters = {name_servo: {} for name_servo, *_ in jobs}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name_servo, step, config in executor.map(_fit_step_job, jobs):
+            if config is not None:
+                parameters[name_servo][step] = config
+
+    configs = {}
+    for name_servo, servo_parameters in parameters.items():
+        if not servo_parameters:
+            print(f"{name_servo}: no step fitted with a mean absolute error below {min_mae}")
+            continue
+
+        max_speed_all, min_speed_all = speed_limits(servo_parameters, max_speed_servo_specs)
+        clean_parameters = clean_up_parameters(
+            parameters=servo_parameters, max_speed_all=max_speed_all, min_speed_all=min_speed_all)
+
+        configs[name_servo] = servo_config(
+            config_analysis=config_analysis, name_servo=name_servo, clean_parameters=clean_parameters,
+            min_speed_all=min_speed_all, max_speed_all=max_speed_all)
+        print(f"{name_servo}: steps {list(clean_parameters)}")
+
+    for path_config_save in path_config_saves:
+        config_final = load_json(path_config_save)
+        config_final.update(configs)
+
+        save_json(path=path_config_save, json_to_save=config_final)
+
+
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="fit the speed model of the servos")
+    parser.add_argument("--batch", action="store_true",
+                        help="fit every servo of the data folder in parallel instead of servo_sg9 only")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes in batch mode")
+    parser.add_argument("--fits", default=None,
+                        help="save the fits done during the acquisition (data/*_fits.json) instead of fitting the csv")
+    args = parser.parse_args()
+
+    if args.fits:
+        run_fits(path_fits=args.fits)
+    elif args.batch:
+        run_batch(workers=args.workers)
+    else:
+        run()
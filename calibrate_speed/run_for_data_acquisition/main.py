@@ -1,89 +1,269 @@
 import json
-from time import sleep, time_ns
-import RPi.GPIO as GPIO
+import multiprocessing
+import os
+from time import monotonic_ns
+from typing import NamedTuple, Optional
+
+from atomic_file import atomic_open
+from online_regression import OnlineRegression
+from photo_interrupter import PhotoInterrupter, SimulatedPhotoInterrupter
+from sample_logger import SampleLogger
 from servo_motor_for_analysis import ServoController
+from simulated_rig import SimulatedRigBackend
+from sweep_planner import SweepPlanner
+
+
+class Rig(NamedTuple):
+    """ a servo and the photo interrupter that measures its rotations """
+    servo_pin: int
+    sensor_pin: int
+    servo_name: str  # servo config of params/servo_params.json
 
 
 class Main:
-    """ main class that will handle the loop """
-    SERVO_NAME = "servo_sg9"
+    """ main class that will handle the loop of one rig """
     FILE_NAME = f"time_analysis_raspberry_3"
 
+    # every rig runs its sweeps concurrently, in its own process
+    RIGS = [Rig(servo_pin=2, sensor_pin=3, servo_name="servo_sg9")]
+    # simulated servos and photo interrupters, to run the acquisition without hardware
+    SIMULATED = False
+
     MAX_SPEED = 600
 
+    DEBOUNCE_MS = 5
+    # the edge of the sensor is awaited until the end of the move plus this margin, then the epoch is run again
+    EDGE_MARGIN_S = 1.
+    MAX_ATTEMPTS = 3
+
+    # measure only the points needed to fit each step instead of the 101 percent_waiting values
+    ADAPTIVE = True
+    MIN_MAE = 0.9  # min_mae of create_speed_config.py
+    # the full sweep of a step stops when its fit has not grown for PATIENCE samples
+    PATIENCE = 5
+
     min_val_inc = -90
     max_val_inc = 90
 
-    def __init__(self):
+    def __init__(self, rig: Rig = RIGS[0], name: Optional[str] = None, simulated: bool = False):
         """
         init function
+        :param rig: pins and servo config of the rig
+        :param name: name of the output files and of the logs, the servo config name by default
+        :param simulated: use a simulated servo and photo interrupter
         """
         with open("./params/servo_params.json") as infile:
             self._conf = json.load(infile)
 
-        self._servo = ServoController(signal_pin=2, **self._conf[self.SERVO_NAME])
+        self._rig = rig
+        self._name = rig.servo_name if name is None else name
+
+        conf = self._conf[rig.servo_name]
+        if simulated:
+            self._photo_intercept = SimulatedPhotoInterrupter(pin=rig.sensor_pin, debounce_ms=self.DEBOUNCE_MS)
+            backend = SimulatedRigBackend(sensor=self._photo_intercept, conf=conf)
+        else:
+            self._photo_intercept = PhotoInterrupter(pin=rig.sensor_pin, debounce_ms=self.DEBOUNCE_MS)
+            backend = None
+
+        self._servo = ServoController(signal_pin=rig.servo_pin, backend=backend, **conf)
 
-        self._gpio_photo_intercept = 3
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
+        # the samples already written by an interrupted run are kept, delete the file to start over
+        self._logger = SampleLogger(f'../data/{self.FILE_NAME}_{self._name}.bin')
 
-        GPIO.setup(self._gpio_photo_intercept, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        # fits updated at each sample, the provisional speed config is saved after each step
+        self._regression = OnlineRegression(tolerance=self.MIN_MAE, patience=self.PATIENCE)
+        self._path_fits = f'../data/{self.FILE_NAME}_{self._name}_fits.json'
+
+    def _run(self, percent_waiting: int, step: int) -> Optional[tuple]:
+        """
+        run one epoch, again if the edge of the sensor is missed
+        :return: waiting time between each step in seconds, rotation speed in degree/s.
+            None if the edge was missed MAX_ATTEMPTS times, nothing is logged
+        """
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            self._photo_intercept.clear()
+            start_time = monotonic_ns()
+            waiting_time = \
+                self._servo.go_to_position(angle=self.max_val_inc, percent_waiting=percent_waiting, steps=step)
 
-    def _run(self, percent_waiting: int, step: int) -> None:
-        """ run one epoch """
-        start_time = time_ns()
-        waiting_time = \
-            self._servo.go_to_position(angle=self.max_val_inc, percent_waiting=percent_waiting, steps=step)
+            # the end of the rotation is the time of the IR sensor edge
+            end_time = self._photo_intercept.wait_edge(
+                timeout=self._servo.remaining_settle_time() + self.EDGE_MARGIN_S)
+            if end_time is not None:
+                break
 
-        # While the IR sensor is not activated we wait
-        while not GPIO.input(self._gpio_photo_intercept):
-            sleep(0.001)
+            print(f"[{self._name}] no edge of the sensor -- step: {step} -- percent_waiting: {percent_waiting} "
+                  f"-- attempt {attempt}/{self.MAX_ATTEMPTS}")
+            self._init_position()
+        else:
+            return None
 
-        rotation_time = (time_ns() - start_time) / (10 ** 9)
+        rotation_time = (end_time - start_time) / (10 ** 9)
         rotation_speed = 180 / rotation_time
 
-        self._append_file(f"{rotation_speed},{step},{waiting_time}")
+        self._logger.append(
+            rotation_speed=rotation_speed, step=step, waiting_time=waiting_time, percent_waiting=percent_waiting)
 
-        print(f"rotation_speed(°/s): {rotation_speed} -- "
+        print(f"[{self._name}] rotation_speed(°/s): {rotation_speed} -- "
               f"step: {step} -- waiting_time(s) {waiting_time}")
 
         self._init_position()
 
+        return waiting_time, rotation_speed
+
+    def _run_adaptive(self, step: int) -> None:
+        """ run the epochs of one step chosen by the sweep planner """
+        planner = SweepPlanner(
+            waiting_time=lambda percent_waiting: self._servo.waiting_time(percent_waiting) * 1000,
+            tolerance=self.MIN_MAE, fit=self._regression.step(step))
+
+        # samples of an interrupted run
+        for percent_waiting, waiting_time, rotation_speed in self._logged_samples(step):
+            self._add_sample(planner, percent_waiting, waiting_time, rotation_speed)
+
+        percent_waiting = planner.next_point()
+        while percent_waiting is not None:
+            sample = self._run(percent_waiting=percent_waiting, step=step)
+            if sample is None:
+                planner.reject(percent_waiting)
+            else:
+                self._add_sample(planner, percent_waiting, sample[0] * 1000, sample[1])
+            percent_waiting = planner.next_point()
+
+        print(f"[{self._name}] step: {step} converged after {planner.nb_samples} samples")
+
+    def _add_sample(self, planner: SweepPlanner, percent_waiting: int, waiting_time: float,
+                    rotation_speed: float) -> None:
+        """
+        add a sample to the planner, a speed above MAX_SPEED is a wrong edge of the sensor: it is left out of the fit,
+        live or logged, so a resumed sweep fits the same samples as an uninterrupted one
+        """
+        if rotation_speed <= self.MAX_SPEED:
+            planner.add_sample(percent_waiting, waiting_time, rotation_speed)
+        else:
+            planner.reject(percent_waiting)
+
+    def _run_sweep(self, step: int) -> None:
+        """ run the epochs of one step from the longest waiting time, until its fit is stable """
+        fit = self._regression.step(step)
+        completed = set()
+        for percent_waiting, waiting_time, rotation_speed in self._logged_samples(step):
+            if rotation_speed <= self.MAX_SPEED:
+                fit.add(waiting_time, rotation_speed)
+            completed.add(percent_waiting)
+
+        for percent_waiting in range(100, -1, -1):
+            if fit.stable:
+                print(f"[{self._name}] step: {step} fit stable after {fit.nb_samples} samples")
+                break
+
+            if percent_waiting not in completed:
+                sample = self._run(percent_waiting=percent_waiting, step=step)
+                if sample is not None and sample[1] <= self.MAX_SPEED:
+                    fit.add(sample[0] * 1000, sample[1])
+
+    def _logged_samples(self, step: int):
+        """
+        samples of one step written by an interrupted run: percent_waiting, waiting time in ms, speed.
+        The speeds above MAX_SPEED are included, so their points are not measured again
+        """
+        for rotation_speed, step_done, waiting_time, percent_waiting in zip(*self._logger.columns()):
+            if step_done == step:
+                yield percent_waiting, waiting_time * 1000, rotation_speed
+
+    def _save_fits(self) -> None:
+        """
+        save the provisional speed config atomically,
+        read by create_speed_config.py --fits instead of fitting the csv again
+        """
+        for step, (nb_fitted, nb_samples, mae) in self._regression.quality().items():
+            print(f"[{self._name}] step: {step} -- fitted samples: {nb_fitted}/{nb_samples} -- mae: {mae}")
+
+        with atomic_open(self._path_fits) as outfile:
+            json.dump({self._rig.servo_name: self._regression.speed_config()}, outfile, indent=4)
+
     def run(self) -> None:
         """
         core function to iterate
         For each iteration the motion value will be read
         """
-
-        with open(f'../data/{self.FILE_NAME}_{self.SERVO_NAME}.csv', 'w') as fd:
-            fd.write('rotation_speed(°/s),steps,waiting_time(s)\n')
+        completed = self._logger.completed()
+        if completed:
+            print(f"[{self._name}] resume after {len(completed)} samples")
 
         try:
             self._init_position()
             for step in range(180, 0, -10):
-                for percent_waiting in range(100, -1, -1):
-                    self._run(percent_waiting=percent_waiting, step=step)
+                if self.ADAPTIVE:
+                    self._run_adaptive(step=step)
+                else:
+                    self._run_sweep(step=step)
+                self._save_fits()
 
             # full speed
-            self._run(percent_waiting=0, step=1)
+            if (1, 0) not in completed:
+                self._run(percent_waiting=0, step=1)
 
         except KeyboardInterrupt:
-            self._servo.release()
+            pass
 
+        self._photo_intercept.close()
         self._servo.release()
 
+        self._logger.close()
+        self._logger.export_csv(f'../data/{self.FILE_NAME}_{self._name}.csv')
+
     def _init_position(self):
         """ initialize the servo position """
-        sleep(1)
+        # write the buffered samples while the servo is idle
+        self._logger.flush()
+        self._servo.wait_until_settled()
         self._servo.go_to_position(angle=self.min_val_inc, percent_waiting=0, steps=1)
-        sleep(1)
+        self._servo.wait_until_settled()
+
+
+def rig_names(rigs: list) -> list:
+    """ name of the output files of each rig: the servo config name, with the servo pin if several rigs share it """
+    servo_names = [rig.servo_name for rig in rigs]
+    return [rig.servo_name if servo_names.count(rig.servo_name) == 1 else f"pin{rig.servo_pin}_{rig.servo_name}"
+            for rig in rigs]
+
+
+def _run_rig(index: int, rig: Rig, name: str, simulated: bool) -> None:
+    """ run the acquisition of one rig, in its own process """
+    # one CPU per rig when possible, so the timing of a rig is not delayed by the others
+    if hasattr(os, "sched_setaffinity") and os.cpu_count() > 1:
+        os.sched_setaffinity(0, {index % os.cpu_count()})
+
+    Main(rig=rig, name=name, simulated=simulated).run()
+
+
+def run_rigs(rigs: list, simulated: bool = False) -> None:
+    """
+    run the acquisition of several rigs concurrently.
+    Each rig has its own process, so its own interpreter lock, GPIO callback thread and output files
+    :param rigs: list of Rig
+    :param simulated: use simulated servos and photo interrupters
+    """
+    names = rig_names(rigs)
+    if len(rigs) == 1:
+        Main(rig=rigs[0], name=names[0], simulated=simulated).run()
+        return
+
+    processes = [multiprocessing.Process(target=_run_rig, args=(index, rig, name, simulated), name=name)
+                 for index, (rig, name) in enumerate(zip(rigs, names))]
+    for process in processes:
+        process.start()
 
-    def _append_file(self, value: str) -> None:
-        """ write in a file: append mode """
-        with open(f'../data/{self.FILE_NAME}_{self.SERVO_NAME}.csv', 'a') as fd:
-            fd.write(f'{value}\n')
+    # Ctrl+C reaches every process, each rig stops and saves its samples
+    for process in processes:
+        while process.is_alive():
+            try:
+                process.join()
+            except KeyboardInterrupt:
+                pass
 
 
 if __name__ == '__main__':
-    run = Main()
-    run.run()
+    run_rigs(Main.RIGS, simulated=Main.SIMULATED)
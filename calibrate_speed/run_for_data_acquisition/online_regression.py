@@ -0,0 +1,194 @@
+from bisect import insort
+from math import sqrt
+from typing import Optional
+
+
+class StepFit:
+    """
+    Fit of the model rotation_speed = a / waiting_time(ms) + b for the samples of one step, updated at each sample.
+    The criterion is the one of create_speed_config.py: the longest series of samples (at least 4) from the longest
+    waiting time with a weighted mean absolute error below the tolerance.
+    Each sample is weighted by the span of waiting time it represents, as sample_weights does.
+    """
+
+    def __init__(self, tolerance: float = 0.9, patience: int = 5):
+        """
+        init function
+        :param tolerance: maximum mean absolute error in degree/s, the min_mae of create_speed_config.py
+        :param patience: number of samples after which the fit is stable if its series has stopped growing
+        """
+        self._tolerance = tolerance
+        self._patience = patience
+
+        self._samples = []  # (-waiting time in ms, rotation speed), sorted from the longest waiting time
+
+        self._params = None
+        self._mae = None
+        self._valid = False  # the mean absolute error of the fit is below the tolerance
+        self._nb_fitted = 0  # length of the fitted series
+        self._covariance = None  # (sum w, sum w.u, sum w.u², residual variance) of the fitted series
+        self._stalled = 0  # samples added since the fitted series last grew
+
+    @property
+    def nb_samples(self) -> int:
+        """ number of samples added """
+        return len(self._samples)
+
+    @property
+    def nb_fitted(self) -> int:
+        """ number of samples of the fitted series, from the longest waiting time """
+        return self._nb_fitted
+
+    @property
+    def params(self) -> Optional[tuple]:
+        """
+        parameters (a, b) of the fit, None before 4 samples.
+        If no series is below the tolerance yet, the fit of the first 4 samples
+        """
+        return self._params
+
+    @property
+    def mae(self) -> Optional[float]:
+        """ weighted mean absolute error of the fit in degree/s """
+        return self._mae
+
+    @property
+    def stable(self) -> bool:
+        """ the fit is valid and its series has not grown for the last patience samples """
+        return self._valid and self._stalled >= self._patience
+
+    def add(self, waiting_time: float, rotation_speed: float) -> None:
+        """
+        add a sample and update the fit
+        :param waiting_time: waiting time in ms between each step
+        :param rotation_speed: measured speed in degree/s
+        """
+        insort(self._samples, (-waiting_time, rotation_speed))
+
+        nb_fitted = self._nb_fitted
+        self._fit()
+        self._stalled = 0 if self._nb_fitted > nb_fitted or not self._valid else self._stalled + 1
+
+    def uncertainty(self, waiting_time: float) -> float:
+        """ standard error of the speed predicted by the fit for a waiting time in ms """
+        sum_w, sum_u, sum_uu, variance = self._covariance
+        u = 1 / waiting_time
+        det = sum_w * sum_uu - sum_u ** 2
+        return sqrt(max(variance * (sum_w * u * u - 2 * sum_u * u + sum_uu) / det, 0.))
+
+    def config(self) -> Optional[dict]:
+        """ speed config entry of the step, as written by create_speed_config.py, None without a valid fit """
+        if not self._valid:
+            return None
+
+        speeds = [rotation_speed for _, rotation_speed in self._samples[:self._nb_fitted]]
+        return {
+            "min_speed": round(min(speeds), 2),
+            "max_speed": round(max(speeds), 2),
+            "params": list(self._params),
+            "mae": f"{round(self._mae, 4)} degree/s",
+            "overhead_s": round(self._overhead(), 7)
+        }
+
+    def _overhead(self) -> float:
+        """
+        time in seconds added to each waiting time by the loop of this host, as step_overhead of
+        create_speed_config.py: 1 / speed is linear in the waiting time, its intercept is due to the overhead
+        """
+        samples = [(-minus_x, 1 / y) for minus_x, y in self._samples[:self._nb_fitted]]
+        mean_x = sum(x for x, _ in samples) / len(samples)
+        mean_v = sum(v for _, v in samples) / len(samples)
+        slope = sum((x - mean_x) * (v - mean_v) for x, v in samples) / sum((x - mean_x) ** 2 for x, _ in samples)
+
+        return max((mean_v - slope * mean_x) / slope, 0.) / 1000
+
+    def _fit(self) -> None:
+        """
+        weighted least squares fit of the longest series below the tolerance, from prefix sums.
+        The series are tried from the longest one. The fit and the squared error of a series come from the prefix
+        sums, and the mean absolute error is below the root mean squared error: it is computed sample by sample
+        only when the squared error does not settle the series
+        """
+        samples = [(-minus_x, y) for minus_x, y in self._samples]
+        if len(samples) < 4:
+            return
+
+        weights = [abs(samples[0][0] - samples[1][0])]
+        weights += [abs(samples[i - 1][0] - samples[i + 1][0]) / 2 for i in range(1, len(samples) - 1)]
+        weights.append(abs(samples[-2][0] - samples[-1][0]))
+        mean_weight = sum(weights) / len(weights)
+        weights = [weight / mean_weight for weight in weights]
+
+        # (sum w, sum w.u, sum w.u², sum w.y, sum w.u.y, sum w.y²) of the first nb samples, u = 1 / waiting time
+        sums = [(0., 0., 0., 0., 0., 0.)]
+        for (x, y), w in zip(samples, weights):
+            sum_w, sum_u, sum_uu, sum_y, sum_uy, sum_yy = sums[-1]
+            u = 1 / x
+            sums.append((sum_w + w, sum_u + w * u, sum_uu + w * u * u, sum_y + w * y, sum_uy + w * u * y,
+                         sum_yy + w * y * y))
+
+        def mean_absolute_error(nb: int) -> float:
+            return sum(w_i * abs(param_a / x_i + param_b - y_i)
+                       for (x_i, y_i), w_i in zip(samples[:nb], weights)) / sum_w
+
+        # the longest series below the tolerance, the first 4 samples if none
+        for nb in range(len(samples), 3, -1):
+            sum_w, sum_u, sum_uu, sum_y, sum_uy, sum_yy = sums[nb]
+            param_a = (sum_w * sum_uy - sum_u * sum_y) / (sum_w * sum_uu - sum_u ** 2)
+            param_b = (sum_y - param_a * sum_u) / sum_w
+            squared_error = max(sum_yy - param_a * sum_uy - param_b * sum_y, 0.)
+
+            mae = None
+            if squared_error <= self._tolerance ** 2 * sum_w or nb == 4:
+                break
+            mae = mean_absolute_error(nb)
+            if mae <= self._tolerance:
+                break
+
+        if mae is None:
+            mae = mean_absolute_error(nb)
+        self._params = (param_a, param_b)
+        self._mae = mae
+        self._valid = mae <= self._tolerance
+        self._nb_fitted = nb
+        self._covariance = (sum_w, sum_u, sum_uu, squared_error / max(sum_w - 2, 1.))
+
+
+class OnlineRegression:
+    """ fits of every step of a servo updated during the acquisition, see StepFit """
+
+    def __init__(self, tolerance: float = 0.9, patience: int = 5):
+        """
+        init function
+        :param tolerance: maximum mean absolute error in degree/s, the min_mae of create_speed_config.py
+        :param patience: number of samples after which a fit is stable if its series has stopped growing
+        """
+        self._tolerance = tolerance
+        self._patience = patience
+        self._fits = {}  # step -> StepFit, in the order of the acquisition
+
+    def step(self, step: int) -> StepFit:
+        """ fit of a step, created empty if needed """
+        if step not in self._fits:
+            self._fits[step] = StepFit(tolerance=self._tolerance, patience=self._patience)
+        return self._fits[step]
+
+    def add_sample(self, step: int, waiting_time: float, rotation_speed: float) -> StepFit:
+        """
+        add a sample to the fit of its step
+        :param step: number of steps of the rotation
+        :param waiting_time: waiting time in ms between each step
+        :param rotation_speed: measured speed in degree/s
+        """
+        fit = self.step(step)
+        fit.add(waiting_time, rotation_speed)
+        return fit
+
+    def quality(self) -> dict:
+        """ step -> (number of samples fitted, number of samples, mean absolute error in degree/s) """
+        return {step: (fit.nb_fitted, fit.nb_samples, fit.mae) for step, fit in self._fits.items()}
+
+    def speed_config(self) -> dict:
+        """ provisional speed config: the entry of every step with a valid fit, before the clean up """
+        configs = {step: fit.config() for step, fit in self._fits.items()}
+        return {step: config for step, config in configs.items() if config is not None}
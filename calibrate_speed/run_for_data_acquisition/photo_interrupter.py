@@ -0,0 +1,97 @@
+import threading
+from queue import Empty, Queue
+from time import monotonic_ns
+from typing import Optional
+
+
+class PhotoInterrupter:
+    """
+    Edge-triggered photo interrupter.
+    Each rising edge of the sensor is timestamped with time.monotonic_ns in the GPIO callback
+    and put in a queue the measurement code waits on.
+    """
+
+    def __init__(self, pin: int, debounce_ms: float = 5):
+        """
+        init function
+        :param pin: GPIO number where the signal of the sensor is plugged
+        :param debounce_ms: edges closer than this to the previous edge are ignored
+        """
+        self._pin = pin
+        self._debounce_ns = int(debounce_ms * 10 ** 6)
+        self._last_edge = None
+        self._edges = Queue()
+        self._setup()
+
+    def _setup(self) -> None:
+        """ detect the rising edges of the sensor """
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(self._pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(self._pin, GPIO.RISING, callback=self._on_edge)
+
+    def _on_edge(self, _channel: int) -> None:
+        """ GPIO callback """
+        self._record(monotonic_ns())
+
+    def _record(self, timestamp_ns: int) -> None:
+        """ queue the timestamp of an edge unless it is a bounce of the previous one """
+        if self._last_edge is not None and timestamp_ns - self._last_edge < self._debounce_ns:
+            return
+
+        self._last_edge = timestamp_ns
+        self._edges.put(timestamp_ns)
+
+    def clear(self) -> None:
+        """ forget the edges not read yet, to be called before starting a measurement """
+        while True:
+            try:
+                self._edges.get_nowait()
+            except Empty:
+                return
+
+    def wait_edge(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        wait for the next edge
+        :param timeout: maximum waiting time in seconds, no limit by default
+        :return: time.monotonic_ns timestamp of the edge, None if the timeout expired
+        """
+        try:
+            return self._edges.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self) -> None:
+        """ stop the edge detection """
+        self._gpio.remove_event_detect(self._pin)
+
+
+class SimulatedPhotoInterrupter(PhotoInterrupter):
+    """ photo interrupter without hardware, the edges are triggered by the code """
+
+    def _setup(self) -> None:
+        """ no GPIO to set up """
+        self._timers = []
+
+    def trigger(self, delay_s: float = 0.) -> None:
+        """
+        simulate an edge
+        :param delay_s: the edge happens after this delay, from a timer thread like the GPIO callback
+        """
+        if delay_s <= 0:
+            self._on_edge(self._pin)
+            return
+
+        timer = threading.Timer(delay_s, self._on_edge, args=(self._pin,))
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+
+    def close(self) -> None:
+        """ cancel the pending edges """
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
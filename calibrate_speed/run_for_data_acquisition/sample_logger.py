@@ -0,0 +1,129 @@
+import os
+import struct
+from array import array
+
+MAGIC = b"SVLG"
+HEADER = struct.Struct("<4sH")
+CHUNK = struct.Struct("<I")
+VERSION = 1
+
+CSV_HEADER = "rotation_speed(°/s),steps,waiting_time(s)"
+
+
+class SampleLogger:
+    """
+    Buffered log of the acquisition samples.
+    The samples are stored in preallocated arrays and written in chunks to a binary columnar file:
+    each chunk is its number of samples then the columns one after the other
+    (rotation speeds as doubles, steps as int32, waiting times as doubles, percent_waiting as int32).
+    The file is only appended, so an interrupted sweep can be resumed from the samples already written.
+    """
+
+    def __init__(self, path: str, capacity: int = 128, resume: bool = True):
+        """
+        init function
+        :param path: binary file of the samples
+        :param capacity: number of samples kept in memory before writing a chunk
+        :param resume: keep the samples of an existing file, otherwise the file is started over
+        """
+        self._path = path
+        self._capacity = capacity
+
+        self._speeds = array('d', bytes(8 * capacity))
+        self._steps = array('i', bytes(4 * capacity))
+        self._waiting_times = array('d', bytes(8 * capacity))
+        self._percents = array('i', bytes(4 * capacity))
+        self._size = 0
+
+        if resume and os.path.exists(path):
+            _, _, _, _, valid_size = self._read_chunks(path)
+            self._file = open(path, "r+b")
+            # drop a chunk partially written when the previous run was interrupted
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+            self._file.flush()
+
+    def append(self, rotation_speed: float, step: int, waiting_time: float, percent_waiting: int) -> None:
+        """ add one sample, written to the file once the buffer is full """
+        index = self._size
+        self._speeds[index] = rotation_speed
+        self._steps[index] = step
+        self._waiting_times[index] = waiting_time
+        self._percents[index] = percent_waiting
+        self._size = index + 1
+
+        if self._size == self._capacity:
+            self.flush()
+
+    def flush(self) -> None:
+        """ write the buffered samples as one chunk """
+        size = self._size
+        if not size:
+            return
+
+        self._file.write(CHUNK.pack(size))
+        for column in (self._speeds, self._steps, self._waiting_times, self._percents):
+            self._file.write(memoryview(column)[:size])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._size = 0
+
+    def close(self) -> None:
+        """ write the remaining samples and close the file """
+        self.flush()
+        self._file.close()
+
+    def completed(self) -> set:
+        """ (step, percent_waiting) of every sample already written """
+        _, steps, _, percents = self.columns()
+        return set(zip(steps, percents))
+
+    def columns(self) -> tuple:
+        """ rotation speeds, steps, waiting times and percent_waiting of every sample already written """
+        return self._read_chunks(self._path)[:4]
+
+    def export_csv(self, path: str) -> None:
+        """
+        write every sample written so far in the CSV layout used by create_speed_config.py:
+        sorted by decreasing step then decreasing waiting time, the order of a full sweep
+        """
+        samples = sorted(zip(*self.columns()), key=lambda sample: (-sample[1], -sample[3]))
+
+        with open(path, 'w') as fd:
+            fd.write(f'{CSV_HEADER}\n')
+            for rotation_speed, step, waiting_time, _ in samples:
+                fd.write(f'{rotation_speed},{step},{waiting_time}\n')
+
+    @staticmethod
+    def _read_chunks(path: str) -> tuple:
+        """
+        read the columns of a binary file
+        :return: the four columns, size in bytes of the complete chunks (header included)
+        """
+        columns = [array('d'), array('i'), array('d'), array('i')]
+
+        with open(path, "rb") as fd:
+            data = fd.read()
+
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a sample log")
+
+        offset = HEADER.size
+        while offset + CHUNK.size <= len(data):
+            size, = CHUNK.unpack_from(data, offset)
+            end = offset + CHUNK.size + size * sum(column.itemsize for column in columns)
+            if end > len(data):
+                break
+
+            position = offset + CHUNK.size
+            for column in columns:
+                column.frombytes(data[position:position + size * column.itemsize])
+                position += size * column.itemsize
+            offset = end
+
+        return (*columns, offset)
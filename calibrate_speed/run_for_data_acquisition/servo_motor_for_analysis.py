@@ -1,14 +1,17 @@
-from time import sleep
-import RPi.GPIO as GPIO
+from time import monotonic, sleep
+from typing import Optional
+
+from pwm_backend import PWMBackend, RPiGPIOBackend
 
 
 class ServoController:
     """ core class to control a servo motor with any Raspberry Pi except the Pico"""
 
-    def __init__(self, signal_pin: int, **conf):
+    def __init__(self, signal_pin: int, backend: Optional[PWMBackend] = None, **conf):
         """
         init function
         :param signal_pin: GPIO number where the signal of the servo is plugged (yellow wire)
+        :param backend: PWM driver, RPi.GPIO by default
         :param freq: frequency of the PWM (Pulse Width Modulation) in Hz (50 by default)
         """
         period = conf.get("period_ms", 20)  # period of a duty cycle
@@ -17,6 +20,7 @@ class ServoController:
         max_duty = conf.get("max_duty_ms", 2)  # maximum angle of the servo
         self._min_sleep = conf.get("min_sleep_s", 0.001)  # minimum sleeping time between each iteration
         self._max_sleep = conf.get("max_sleep_s", 0.1)  # maximum sleeping time between each iteration
+        self._max_speed = conf.get("max_speed_d_s", 600)  # maximum speed of the servo
 
         self._percent_min = min_duty / period * 100
         self._percent_max = max_duty / period * 100
@@ -24,12 +28,19 @@ class ServoController:
         self._min_duty = self._angle_to_duty(self._max_angle / 2)
         self._max_duty = self._angle_to_duty(- 1 * self._max_angle / 2)
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(signal_pin, GPIO.OUT)
-        self._servo = GPIO.PWM(signal_pin, 1 / period * 1000)
+        self._backend = backend if backend is not None else RPiGPIOBackend()
+        self._servo = self._backend.pwm(signal_pin, 1 / period * 1000)
+        # time for the servo to physically finish a move. max_speed_d_s is the cap of the sweep, not a measured speed:
+        # the moves are assumed at homing_speed_d_s, set well below the real full speed, and last at least min_settle_s
+        self._homing_speed = conf.get("homing_speed_d_s", 100)
+        self._min_settle = conf.get("min_settle_s", 1.)
+        self._settle_margin = conf.get("settle_margin_s", 0.05)
+        self._settle_deadline = 0.
+
         self._current_angle = 0
         self._servo.start((self._percent_max - self._percent_min) / 2 + self._percent_min)
-        sleep(1)
+        # the position before the start is unknown: the servo may have to rotate half of its range
+        self._update_settle(distance=self._max_angle / 2, elapsed=0.)
 
     def go_to_position(self, angle: int, percent_waiting: int, steps: int) -> float:
         """
@@ -46,16 +57,18 @@ class ServoController:
         angle = max(-self._max_angle / 2, angle)
         angle = min(self._max_angle / 2, angle)
 
+        start = monotonic()
         value_start = self._angle_to_duty(angle=self._current_angle)
         value_end = self._angle_to_duty(angle=angle)
 
         steps = (self._max_duty - self._min_duty) / steps
         increment = steps if value_end - value_start > 0 else -steps
 
-        waiting_time = (self._max_sleep - self._min_sleep) * percent_waiting / 100 + self._min_sleep
+        waiting_time = self.waiting_time(percent_waiting)
 
         if abs(increment) >= abs(angle - self._current_angle):
             self._servo.ChangeDutyCycle(value_end)
+            self._update_settle(distance=abs(angle - self._current_angle), elapsed=0.)
             self._current_angle = angle
             return waiting_time
 
@@ -74,9 +87,33 @@ class ServoController:
                 self._servo.ChangeDutyCycle(value_end)
             sleep(waiting_time)
 
+        self._update_settle(distance=abs(angle - self._current_angle), elapsed=monotonic() - start)
         self._current_angle = angle
         return waiting_time
 
+    def waiting_time(self, percent_waiting: int) -> float:
+        """ waiting time in seconds between each step for a percent of the maximum waiting time """
+        return (self._max_sleep - self._min_sleep) * percent_waiting / 100 + self._min_sleep
+
+    def remaining_settle_time(self) -> float:
+        """ time in seconds until the servo has physically finished the last move, see wait_until_settled """
+        return max(self._settle_deadline - monotonic(), 0.)
+
+    def wait_until_settled(self) -> None:
+        """ wait until the servo has physically finished the last move, according to its homing speed """
+        remaining = self._settle_deadline - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def _update_settle(self, distance: float, elapsed: float) -> None:
+        """
+        estimate when the servo stops after a move, conservatively: every sample starts from the homing position
+        :param distance: rotation in degree
+        :param elapsed: time already spent on the move in seconds
+        """
+        remaining = max(distance / self._homing_speed - elapsed, self._min_settle - elapsed, 0.)
+        self._settle_deadline = monotonic() + remaining + self._settle_margin
+
     def _angle_to_duty(self, angle: int) -> float:
         """ convert the angle to duty cycle """
         percent_duty = (angle + self._max_angle / 2) / self._max_angle
@@ -86,4 +123,4 @@ class ServoController:
     def release(self) -> None:
         """ release the PWM """
         self._servo.stop()
-        GPIO.cleanup()
+        self._backend.cleanup()
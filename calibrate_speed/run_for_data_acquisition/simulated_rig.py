@@ -0,0 +1,77 @@
+import random
+from time import monotonic
+
+from photo_interrupter import SimulatedPhotoInterrupter
+from pwm_backend import SimulatedBackend, SimulatedPWM
+
+
+class SimulatedServoPWM(SimulatedPWM):
+    """
+    PWM channel of a simulated servo: the arm follows the commanded position at most at max_speed
+    and cuts the photo interrupter when it reaches the sensor position
+    """
+
+    def __init__(self, pin: int, frequency: float, sensor: SimulatedPhotoInterrupter, sensor_duty: float,
+                 duty_per_degree: float, max_speed: float, jitter_s: float):
+        """
+        init function
+        :param sensor: photo interrupter triggered by the arm
+        :param sensor_duty: duty cycle of the position of the sensor
+        :param duty_per_degree: duty cycle variation for one degree
+        :param max_speed: maximum rotation speed of the arm in degree/s
+        :param jitter_s: standard deviation of the sensor edge time in seconds
+        """
+        super().__init__(pin, frequency)
+        self._sensor = sensor
+        self._sensor_duty = sensor_duty
+        self._duty_speed = max_speed * duty_per_degree  # duty cycle variation per second
+        self._jitter = jitter_s
+        self._arrival = 0.  # time the arm reaches the last commanded position
+
+    def ChangeDutyCycle(self, duty: float) -> None:
+        """ record the new duty cycle and move the simulated arm """
+        previous = self.duty
+        super().ChangeDutyCycle(duty)
+        if previous is None:
+            return
+
+        now = monotonic()
+        self._arrival = max(now, self._arrival) + abs(duty - previous) / self._duty_speed
+
+        if abs(duty - self._sensor_duty) < 1e-9 <= abs(previous - self._sensor_duty):
+            self._sensor.trigger(max(self._arrival - now + random.gauss(0., self._jitter), 0.))
+
+
+class SimulatedRigBackend(SimulatedBackend):
+    """ PWM backend of a simulated acquisition rig, the servo cuts the photo interrupter at the end of its sweep """
+
+    def __init__(self, sensor: SimulatedPhotoInterrupter, conf: dict, sensor_angle: float = 90,
+                 max_speed_d_s: float = 250, jitter_s: float = 0.0005):
+        """
+        init function
+        :param sensor: photo interrupter of the rig
+        :param conf: servo config, for the conversion between angle and duty cycle
+        :param sensor_angle: position of the sensor in degree
+        :param max_speed_d_s: maximum rotation speed of the simulated servo in degree/s
+        :param jitter_s: standard deviation of the sensor edge time in seconds
+        """
+        super().__init__()
+        self._sensor = sensor
+        self._max_speed = max_speed_d_s
+        self._jitter = jitter_s
+
+        period = conf.get("period_ms", 20)
+        max_angle = conf.get("max_angle", 180)
+        percent_min = conf.get("min_duty_ms", 1) / period * 100
+        percent_max = conf.get("max_duty_ms", 2) / period * 100
+
+        # same conversion as ServoController._angle_to_duty
+        self._duty_per_degree = (percent_max - percent_min) / max_angle
+        self._sensor_duty = percent_max - (sensor_angle + max_angle / 2) * self._duty_per_degree
+
+    def pwm(self, pin: int, frequency: float) -> SimulatedServoPWM:
+        """ set up the PWM output of the simulated servo """
+        self.channels[pin] = SimulatedServoPWM(
+            pin, frequency, sensor=self._sensor, sensor_duty=self._sensor_duty,
+            duty_per_degree=self._duty_per_degree, max_speed=self._max_speed, jitter_s=self._jitter)
+        return self.channels[pin]
@@ -0,0 +1,102 @@
+from typing import Callable, Optional
+
+from online_regression import StepFit
+
+
+class SweepPlanner:
+    """
+    Adaptive choice of the percent_waiting values measured for one step.
+    The sweep starts with a coarse grid. After each sample, the model rotation_speed = a / waiting_time(ms) + b
+    is fitted the way create_speed_config.py does (see StepFit): on the longest series of samples from the longest
+    waiting time with a weighted mean absolute error below the tolerance. A point is then added in the middle of:
+    - the interval where that series stops, to locate the end of the range the model can fit
+    - the interval of the series where the standard error of the prediction is the highest,
+    as long as it is above max_uncertainty
+    The step has converged when no interval needs a point.
+    """
+
+    def __init__(self, waiting_time: Callable[[int], float], tolerance: float = 0.9,
+                 max_uncertainty: Optional[float] = None, nb_coarse: int = 6, min_gap: int = 1,
+                 fit: Optional[StepFit] = None):
+        """
+        init function
+        :param waiting_time: waiting time in ms between each step of the servo for a percent_waiting
+        :param tolerance: maximum mean absolute error in degree/s, the min_mae of create_speed_config.py
+        :param max_uncertainty: maximum standard error of the predicted speed in degree/s, tolerance / 2 by default
+        :param nb_coarse: number of points of the first grid, from 100 to 0
+        :param min_gap: an interval is not split below this percent_waiting gap
+        :param fit: fit updated with the samples, to share it with an OnlineRegression, a new one by default
+        """
+        self._waiting_time = waiting_time
+        self._tolerance = tolerance
+        self._max_uncertainty = tolerance / 2 if max_uncertainty is None else max_uncertainty
+        self._min_gap = min_gap
+
+        self._coarse = [round(100 - i * 100 / (nb_coarse - 1)) for i in range(nb_coarse)]
+        self._samples = set()  # measured percent_waiting, rejected ones included
+        self._percents = []  # percent_waiting of the samples of the fit, from the longest waiting time
+        self._fitted = set()
+        self._fit = StepFit(tolerance=tolerance) if fit is None else fit
+
+    @property
+    def nb_samples(self) -> int:
+        """ number of points measured """
+        return len(self._samples)
+
+    @property
+    def params(self) -> Optional[tuple]:
+        """ parameters (a, b) of the current fit, None before the fit """
+        return self._fit.params
+
+    def add_sample(self, percent_waiting: int, waiting_time: float, rotation_speed: float) -> None:
+        """
+        record a measurement and update the fit, a percent_waiting already measured is ignored
+        :param percent_waiting: value given to go_to_position
+        :param waiting_time: waiting time in ms between each step
+        :param rotation_speed: measured speed in degree/s
+        """
+        if percent_waiting in self._samples:
+            return
+
+        self._samples.add(percent_waiting)
+        self._fitted.add(percent_waiting)
+        self._percents = sorted(self._fitted, reverse=True)
+        self._fit.add(waiting_time, rotation_speed)
+
+    def reject(self, percent_waiting: int) -> None:
+        """ record a measurement left out of the fit, an outlier: the point is not measured again """
+        self._samples.add(percent_waiting)
+
+    def next_point(self) -> Optional[int]:
+        """ next percent_waiting to measure, None when the step has converged """
+        for percent_waiting in self._coarse:
+            if percent_waiting not in self._samples:
+                return percent_waiting
+
+        if self._fit.params is None:
+            return None
+
+        percents = self._percents
+        nb_fitted = self._fit.nb_fitted
+
+        # locate the end of the fitted series first
+        if nb_fitted < len(percents):
+            high, low = percents[nb_fitted - 1], percents[nb_fitted]
+            if high - low > self._min_gap and (high + low) // 2 not in self._samples:
+                return (high + low) // 2
+
+        best_uncertainty = self._max_uncertainty
+        best_point = None
+        for high, low in zip(percents[:nb_fitted - 1], percents[1:nb_fitted]):
+            if high - low <= self._min_gap:
+                continue
+
+            middle = (high + low) // 2
+            if middle in self._samples:
+                continue
+            uncertainty = self._fit.uncertainty(self._waiting_time(middle))
+            if uncertainty > best_uncertainty:
+                best_uncertainty = uncertainty
+                best_point = middle
+
+        return best_point
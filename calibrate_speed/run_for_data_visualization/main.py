@@ -1,8 +1,7 @@
 import json
-from time import sleep, time_ns
-
-from RPi import GPIO
+from time import monotonic_ns
 
+from photo_interrupter import PhotoInterrupter
 from servo_motor import ServoController
 
 
@@ -11,6 +10,11 @@ class Main:
     FILE_NAME = "data_rotation_results"
     SERVO_NAME = "servo_s53_20"
 
+    DEBOUNCE_MS = 5
+    # the edge of the sensor is awaited until the end of the move plus this margin, then the epoch is run again
+    EDGE_MARGIN_S = 1.
+    MAX_ATTEMPTS = 3
+
     min_val_inc = -90
     max_val_inc = 90
 
@@ -27,23 +31,28 @@ class Main:
 
         self._servo = ServoController(signal_pin=2, **self._conf[self.SERVO_NAME])
 
-        self._gpio_photo_intercept = 3
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-
-        GPIO.setup(self._gpio_photo_intercept, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self._photo_intercept = PhotoInterrupter(pin=3, debounce_ms=self.DEBOUNCE_MS)
 
     def _run(self, percent_speed: float) -> None:
-        """ run one epoch """
-        start_time = time_ns()
+        """ run one epoch, again if the edge of the sensor is missed. Skipped after MAX_ATTEMPTS missed edges """
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            self._photo_intercept.clear()
+            start_time = monotonic_ns()
 
-        waiting_time, step = self._servo.go_to_position(angle=self.max_val_inc, percent_speed=percent_speed)
+            waiting_time, step = self._servo.go_to_position(angle=self.max_val_inc, percent_speed=percent_speed)
 
-        # While the IR sensor is not activated we wait
-        while not GPIO.input(self._gpio_photo_intercept):
-            sleep(0.001)
+            # the end of the rotation is the time of the IR sensor edge
+            end_time = self._photo_intercept.wait_edge(
+                timeout=self._servo.remaining_settle_time() + self.EDGE_MARGIN_S)
+            if end_time is not None:
+                break
+
+            print(f"no edge of the sensor -- percent_speed: {percent_speed} -- attempt {attempt}/{self.MAX_ATTEMPTS}")
+            self._init_position()
+        else:
+            return
 
-        rotation_time = (time_ns() - start_time) / (10 ** 9)
+        rotation_time = (end_time - start_time) / (10 ** 9)
         rotation_speed = 180 / rotation_time
 
         self._append_file(f"{percent_speed},{rotation_speed}")
@@ -64,15 +73,16 @@ class Main:
                 self._run(percent_speed=percent_speed)
 
         except KeyboardInterrupt:
-            self._servo.release()
+            pass
 
+        self._photo_intercept.close()
         self._servo.release()
 
     def _init_position(self):
         """ initialize the servo position """
-        sleep(1)
+        self._servo.wait_until_settled()
         self._servo.go_to_position(angle=self.min_val_inc, percent_speed=100)
-        sleep(1)
+        self._servo.wait_until_settled()
 
     def _append_file(self, value: str) -> None:
         """ write in a file: append mode """
@@ -0,0 +1,112 @@
+from array import array
+from time import perf_counter_ns
+
+
+class PWMBackend:
+    """
+    interface of a PWM driver.
+    pwm returns a channel with the same methods as RPi.GPIO.PWM: start, ChangeDutyCycle and stop
+    """
+
+    def pwm(self, pin: int, frequency: float):
+        """
+        set up a PWM output
+        :param pin: GPIO number (BCM numbering)
+        :param frequency: frequency of the PWM in Hz
+        """
+        raise NotImplementedError
+
+    def cleanup(self) -> None:
+        """ release every GPIO used by the backend """
+        raise NotImplementedError
+
+
+class RPiGPIOBackend(PWMBackend):
+    """ hardware PWM through the RPi.GPIO library, only available on a Raspberry Pi """
+
+    def __init__(self):
+        """
+        init function
+        """
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def pwm(self, pin: int, frequency: float):
+        """ set up a PWM output """
+        self._gpio.setup(pin, self._gpio.OUT)
+        return self._gpio.PWM(pin, frequency)
+
+    def cleanup(self) -> None:
+        """ release every GPIO used by the backend """
+        self._gpio.cleanup()
+
+
+class SimulatedPWM:
+    """ in-memory PWM channel that records each duty cycle change with a perf_counter_ns timestamp """
+
+    def __init__(self, pin: int, frequency: float):
+        """
+        init function
+        :param pin: GPIO number (BCM numbering)
+        :param frequency: frequency of the PWM in Hz
+        """
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = None
+        self.running = False
+
+        self.times_ns = array('q')
+        self.duties = array('d')
+        self._append_time = self.times_ns.append
+        self._append_duty = self.duties.append
+
+    def start(self, duty: float) -> None:
+        """ start the PWM output """
+        self.running = True
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty: float) -> None:
+        """ record the new duty cycle """
+        self._append_time(perf_counter_ns())
+        self._append_duty(duty)
+        self.duty = duty
+
+    def ChangeFrequency(self, frequency: float) -> None:
+        """ change the frequency of the PWM """
+        self.frequency = frequency
+
+    def stop(self) -> None:
+        """ stop the PWM output """
+        self.running = False
+
+    def intervals(self) -> array:
+        """ time in seconds between each recorded duty cycle change """
+        times = self.times_ns
+        return array('d', ((times[i] - times[i - 1]) / 10 ** 9 for i in range(1, len(times))))
+
+    def reset(self) -> None:
+        """ forget the recorded duty cycle changes """
+        del self.times_ns[:]
+        del self.duties[:]
+
+
+class SimulatedBackend(PWMBackend):
+    """ PWM backend without hardware, to run and time the motion code on any computer """
+
+    def __init__(self):
+        """
+        init function
+        """
+        self.channels = {}  # pin -> SimulatedPWM
+
+    def pwm(self, pin: int, frequency: float) -> SimulatedPWM:
+        """ set up a simulated PWM output """
+        self.channels[pin] = SimulatedPWM(pin, frequency)
+        return self.channels[pin]
+
+    def cleanup(self) -> None:
+        """ stop every simulated output """
+        for channel in self.channels.values():
+            channel.stop()
@@ -1,14 +1,17 @@
-from time import sleep
-import RPi.GPIO as GPIO
+from time import monotonic, sleep
+from typing import Optional
+
+from pwm_backend import PWMBackend, RPiGPIOBackend
 
 
 class ServoController:
     """ core class to control a servo motor with any Raspberry Pi except the Pico"""
 
-    def __init__(self, signal_pin: int, **conf):
+    def __init__(self, signal_pin: int, backend: Optional[PWMBackend] = None, **conf):
         """
         init function
         :param signal_pin: GPIO number where the signal of the servo is plugged (yellow wire)
+        :param backend: PWM driver, RPi.GPIO by default
         :param freq: frequency of the PWM (Pulse Width Modulation) in Hz (50 by default)
         """
         period = conf.get("period_ms", 20)  # period of a duty cycle
@@ -28,12 +31,16 @@ class ServoController:
 
         self._min_increment = (self._percent_max - self._percent_min) / self._max_angle
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(signal_pin, GPIO.OUT)
-        self._servo = GPIO.PWM(signal_pin, 1 / period * 1000)
+        self._backend = backend if backend is not None else RPiGPIOBackend()
+        self._servo = self._backend.pwm(signal_pin, 1 / period * 1000)
+        # time for the servo to physically finish a move, on top of the speed model
+        self._settle_margin = conf.get("settle_margin_s", 0.05)
+        self._settle_deadline = 0.
+
         self._current_angle = 0
         self._servo.start((self._percent_max - self._percent_min) / 2 + self._percent_min)
-        sleep(1)
+        # the position before the start is unknown: the servo may have to rotate half of its range
+        self._update_settle(distance=self._max_angle / 2, elapsed=0.)
 
     def go_to_position(self, angle: int, percent_speed: float) -> tuple:
         """
@@ -48,6 +55,7 @@ class ServoController:
         angle = max(-self._max_angle / 2, angle)
         angle = min(self._max_angle / 2, angle)
 
+        start = monotonic()
         value_start = self._angle_to_duty(angle=self._current_angle)
         value_end = self._angle_to_duty(angle=angle)
 
@@ -58,6 +66,7 @@ class ServoController:
 
         if abs(increment) >= abs(angle - self._current_angle):
             self._servo.ChangeDutyCycle(value_end)
+            self._update_settle(distance=abs(angle - self._current_angle), elapsed=0.)
             self._current_angle = angle
             return waiting_time, step_calc
 
@@ -76,13 +85,33 @@ class ServoController:
                 self._servo.ChangeDutyCycle(value_end)
             sleep(waiting_time)
 
+        self._update_settle(distance=abs(angle - self._current_angle), elapsed=monotonic() - start)
         self._current_angle = angle
         return waiting_time, step_calc
 
     def release(self) -> None:
         """ release the PWM """
         self._servo.stop()
-        GPIO.cleanup()
+        self._backend.cleanup()
+
+    def remaining_settle_time(self) -> float:
+        """ time in seconds until the servo has physically finished the last move, see wait_until_settled """
+        return max(self._settle_deadline - monotonic(), 0.)
+
+    def wait_until_settled(self) -> None:
+        """ wait until the servo has physically finished the last move, according to its maximum speed """
+        remaining = self._settle_deadline - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def _update_settle(self, distance: float, elapsed: float) -> None:
+        """
+        estimate when the servo stops after a move: it cannot rotate faster than its maximum speed
+        :param distance: rotation in degree
+        :param elapsed: time already spent on the move in seconds
+        """
+        remaining = max(distance / self._max_speed - elapsed, 0.)
+        self._settle_deadline = monotonic() + remaining + self._settle_margin
 
     def _angle_to_duty(self, angle: int) -> float:
         """ convert the angle to duty cycle """
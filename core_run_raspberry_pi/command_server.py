@@ -0,0 +1,310 @@
+import argparse
+import os
+import queue
+import socket
+import struct
+import threading
+from itertools import count
+from typing import NamedTuple, Optional, Union
+
+from motion_profiles import PROFILES
+from servo_motor import ServoController
+
+# command: opcode, servo id, profile index, sequence number, angle in degree, percent_speed
+COMMAND = struct.Struct("<BBHIff")
+# event: kind, servo id, error code, sequence number of the command, angle reached in degree
+EVENT = struct.Struct("<BBHIf")
+
+MOVE = 1  # queue a move of the servo
+CLEAR = 2  # drop the moves queued for the servo, the current move finishes
+
+ACK = 1  # the command is accepted
+DONE = 2  # the move is finished
+ERROR = 3  # the command is rejected or the move failed
+
+UNKNOWN_SERVO = 1
+UNKNOWN_OPCODE = 2
+UNKNOWN_PROFILE = 3
+MOVE_FAILED = 4
+CLEARED = 5  # the move was dropped by a CLEAR before it started
+
+Address = Union[str, tuple]
+
+
+class Event(NamedTuple):
+    """ reply of the server to a command """
+    kind: int  # ACK, DONE or ERROR
+    servo: int
+    error: int  # 0, or the reason of an ERROR
+    seq: int
+    angle: float  # angle reached for DONE, commanded angle otherwise
+
+
+def _socket(address: Address) -> socket.socket:
+    """ datagram socket for a Unix socket path or a (host, port) UDP address """
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    return socket.socket(family, socket.SOCK_DGRAM)
+
+
+class CommandServer:
+    """
+    Local daemon that owns the servo controllers and runs the moves sent by the clients.
+    Commands are fixed-size binary frames sent as datagrams over a Unix socket or UDP, several per packet.
+    Each packet is acknowledged with one reply packet holding an ACK (or ERROR) per command.
+    The moves of each servo are run in order by its own worker thread, which sends a DONE event at the end of each.
+    The events are sent without blocking: the events of a client that does not read them are dropped and counted,
+    so a slow client never stalls the server.
+    """
+
+    def __init__(self, servos: dict, address: Address):
+        """
+        init function
+        :param servos: servo id (0 to 255, the GPIO number for instance) -> ServoController
+        :param address: path of the Unix socket, or (host, port) for UDP
+        """
+        self._servos = servos
+        self._address = address
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        self._socket = _socket(address)
+        self._socket.bind(address)
+
+        self._queues = {servo_id: queue.SimpleQueue() for servo_id in servos}
+        self._threads = []
+        self._running = False
+        self._dropped_events = 0
+
+    @property
+    def dropped_events(self) -> int:
+        """ number of reply packets dropped because the client did not read its events """
+        return self._dropped_events
+
+    def start(self) -> None:
+        """ start the receiving thread and one worker thread per servo """
+        self._running = True
+        self._threads = [threading.Thread(target=self._receive, daemon=True)]
+        self._threads += [threading.Thread(target=self._work, args=(servo_id,), daemon=True)
+                          for servo_id in self._servos]
+        for thread in self._threads:
+            thread.start()
+
+    def serve_forever(self) -> None:
+        """ start the server and block until it is stopped """
+        self.start()
+        try:
+            for thread in self._threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self) -> None:
+        """ stop the threads once their current move is finished, close the socket and release the servos """
+        self._running = False
+        for servo_queue in self._queues.values():
+            servo_queue.put(None)
+        self._socket.close()
+        for thread in self._threads[1:]:
+            thread.join()
+
+        for servo in self._servos.values():
+            servo.release()
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)
+
+    def _receive(self) -> None:
+        """ loop of the receiving thread: dispatch the commands of each packet and acknowledge them """
+        size = COMMAND.size
+        while self._running:
+            try:
+                packet, client = self._socket.recvfrom(65536)
+            except OSError:
+                return
+
+            replies = bytearray()
+            for offset in range(0, len(packet) - size + 1, size):
+                opcode, servo_id, profile, seq, angle, percent_speed = COMMAND.unpack_from(packet, offset)
+                error = self._dispatch(opcode, servo_id, profile, seq, angle, percent_speed, client)
+                replies += EVENT.pack(ERROR if error else ACK, servo_id, error, seq, angle)
+
+            if replies:
+                self._send(bytes(replies), client)
+
+    def _dispatch(self, opcode: int, servo_id: int, profile: int, seq: int, angle: float, percent_speed: float,
+                  client: Address) -> int:
+        """
+        queue a command for the worker of its servo
+        :return: error code, 0 if the command is accepted
+        """
+        servo_queue = self._queues.get(servo_id)
+        if servo_queue is None:
+            return UNKNOWN_SERVO
+
+        if opcode == MOVE:
+            if profile >= len(PROFILES):
+                return UNKNOWN_PROFILE
+            servo_queue.put((seq, angle, percent_speed, PROFILES[profile], client))
+        elif opcode == CLEAR:
+            # drain the queue: the worker only sees the moves queued after the clear
+            try:
+                while True:
+                    command = servo_queue.get_nowait()
+                    if command is None:
+                        # stop marker of the worker, put back
+                        servo_queue.put(None)
+                        break
+                    dropped_seq, dropped_angle, _, _, dropped_client = command
+                    self._send(EVENT.pack(ERROR, servo_id, CLEARED, dropped_seq, dropped_angle), dropped_client)
+            except queue.Empty:
+                pass
+        else:
+            return UNKNOWN_OPCODE
+
+        return 0
+
+    def _work(self, servo_id: int) -> None:
+        """ loop of the worker thread of a servo: run its moves in order """
+        servo = self._servos[servo_id]
+        servo_queue = self._queues[servo_id]
+        while True:
+            command = servo_queue.get()
+            if command is None:
+                return
+
+            seq, angle, percent_speed, profile, client = command
+            try:
+                servo.go_to_position(angle=angle, percent_speed=percent_speed, profile=profile)
+                event = EVENT.pack(DONE, servo_id, 0, seq, servo.current_angle)
+            except Exception:
+                # the worker keeps serving the next moves
+                event = EVENT.pack(ERROR, servo_id, MOVE_FAILED, seq, servo.current_angle)
+            self._send(event, client)
+
+    def _send(self, data: bytes, client: Address) -> None:
+        """ reply to a client without blocking, the reply is dropped if the client is gone or its queue is full """
+        if client is None:
+            return
+        try:
+            self._socket.sendto(data, socket.MSG_DONTWAIT, client)
+        except BlockingIOError:
+            self._dropped_events += 1
+        except OSError:
+            pass
+
+
+class CommandClient:
+    """
+    client of CommandServer, the moves are sent without waiting for their end.
+    The server drops the events that do not fit in the queue of the client socket, read them to keep them all
+    """
+
+    def __init__(self, address: Address, path: Optional[str] = None):
+        """
+        init function
+        :param address: address of the server, path of the Unix socket or (host, port)
+        :param path: path of the socket of the client for a Unix socket, to receive the events.
+            A path next to the server socket by default
+        """
+        self._address = address
+        self._socket = _socket(address)
+        if isinstance(address, str):
+            self._path = path if path is not None else f"{address}.client{os.getpid()}"
+            if os.path.exists(self._path):
+                os.remove(self._path)
+            self._socket.bind(self._path)
+        else:
+            self._path = None
+            self._socket.bind(("", 0))
+
+        self._seq = count(1)
+        self._events = []
+        self._finished = {}  # seq -> DONE or ERROR event received by wait_done while waiting for another command
+
+    def move(self, servo: int, angle: float, percent_speed: float, profile: str = "constant") -> int:
+        """
+        send a move
+        :return: sequence number of the command
+        """
+        return self.send_batch([(servo, angle, percent_speed, profile)])[0]
+
+    def clear(self, servo: int) -> int:
+        """ drop the moves queued for a servo, return the sequence number of the command """
+        seq = next(self._seq)
+        self._socket.sendto(COMMAND.pack(CLEAR, servo, 0, seq, 0., 0.), self._address)
+        return seq
+
+    def send_batch(self, moves: list) -> list:
+        """
+        send several moves in one packet
+        :param moves: list of (servo, angle, percent_speed, profile)
+        :return: sequence number of each move
+        """
+        seqs = []
+        packet = bytearray()
+        for servo, angle, percent_speed, profile in moves:
+            seq = next(self._seq)
+            packet += COMMAND.pack(MOVE, servo, PROFILES.index(profile), seq, angle, percent_speed)
+            seqs.append(seq)
+
+        self._socket.sendto(bytes(packet), self._address)
+        return seqs
+
+    def recv_event(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """ next event sent by the server, None if the timeout expired """
+        if not self._events:
+            self._socket.settimeout(timeout)
+            try:
+                packet = self._socket.recv(65536)
+            except socket.timeout:
+                return None
+            self._events = [Event(*EVENT.unpack_from(packet, offset))
+                            for offset in range(0, len(packet) - EVENT.size + 1, EVENT.size)]
+
+        return self._events.pop(0)
+
+    def wait_done(self, seq: int, timeout: Optional[float] = None) -> Optional[Event]:
+        """
+        wait for the DONE or ERROR event of a command.
+        The DONE and ERROR events of the other commands received meanwhile are kept for their own wait_done
+        :return: the event, None if the timeout expired
+        """
+        if seq in self._finished:
+            return self._finished.pop(seq)
+
+        while True:
+            event = self.recv_event(timeout)
+            if event is None or (event.seq == seq and event.kind != ACK):
+                return event
+            if event.kind != ACK:
+                self._finished[event.seq] = event
+
+    def close(self) -> None:
+        """ close the socket """
+        self._socket.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def _parse_address(value: str) -> Address:
+    """ "host:port" for UDP, a path for a Unix socket """
+    host, _, port = value.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return value
+
+
+if __name__ == '__main__':
+    from servo_profiles import load_profiles
+
+    parser = argparse.ArgumentParser(description="serve the moves of the servos over a Unix socket or UDP")
+    parser.add_argument("--address", default="/tmp/servo.sock", help="path of a Unix socket, or host:port for UDP")
+    parser.add_argument("--servo", action="append", default=[], metavar="NAME:PIN",
+                        help="servo config of params/servo_params.json and GPIO number, the pin is the servo id")
+    args = parser.parse_args()
+
+    conf = load_profiles("params/servo_params.json")
+    servos = {}
+    for servo_arg in args.servo or ["servo_sg9:2"]:
+        name, pin = servo_arg.rsplit(":", 1)
+        servos[int(pin)] = ServoController(signal_pin=int(pin), **conf[name])
+
+    CommandServer(servos, _parse_address(args.address)).serve_forever()
@@ -1,7 +1,5 @@
-import json
-from time import sleep
-
 from servo_motor import ServoController
+from servo_profiles import load_profiles
 
 
 class Main:
@@ -16,11 +14,11 @@ class Main:
         """
         init function
         """
-        # load the servo conf
-        with open("params/servo_params.json") as infile:
-            self._conf = json.load(infile)
+        # load the servo conf, compiled and cached
+        self._conf = load_profiles("params/servo_params.json")
 
-        self._servo = ServoController(signal_pin=2, **self._conf[self.SERVO_NAME])
+        # the last angle is saved in state/, a restart resumes from it instead of re-homing
+        self._servo = ServoController(signal_pin=2, state_dir="state", **self._conf[self.SERVO_NAME])
 
     def _run(self, percent_speed: float) -> None:
         """ run one epoch """
@@ -43,11 +41,34 @@ class Main:
 
         self._servo.release()
 
+    async def _run_async(self, percent_speed: float) -> None:
+        """ run one epoch without blocking the event loop """
+        await self._servo.go_to_position_async(angle=self.max_val_inc, percent_speed=percent_speed)
+
+        await self._init_position_async()
+
+    async def run_async(self) -> None:
+        """
+        same loop as run, as a coroutine that can share the event loop with other tasks and be cancelled
+        """
+        try:
+            await self._init_position_async()
+            for percent_speed in range(0, 110, 10):
+                await self._run_async(percent_speed=percent_speed)
+        finally:
+            self._servo.release()
+
     def _init_position(self):
         """ initialize the servo position """
-        sleep(1)
+        self._servo.wait_until_settled()
         self._servo.go_to_position(angle=self.min_val_inc, percent_speed=100)
-        sleep(1)
+        self._servo.wait_until_settled()
+
+    async def _init_position_async(self):
+        """ initialize the servo position without blocking the event loop """
+        await self._servo.wait_until_settled_async()
+        await self._servo.go_to_position_async(angle=self.min_val_inc, percent_speed=100)
+        await self._servo.wait_until_settled_async()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+import heapq
+import threading
+from time import monotonic
+from typing import Optional
+
+from servo_motor import ServoController, Trajectory
+from timing import sleep_until
+
+
+class MotionEngine:
+    """
+    Drive several servo motors from a single timing thread.
+    The moves added with add_move are run together by run: the steps of every servo are merged into one
+    time-ordered queue and each step is fired at an absolute deadline.
+    A servo in streaming mode cannot be moved, and a single batch runs at a time.
+    """
+
+    def __init__(self, spin_s: float = 0.0002, deadline_tolerance_s: float = 0.0005):
+        """
+        init function
+        :param spin_s: duration of the busy wait at the end of each deadline wait
+        :param deadline_tolerance_s: lateness of a step counted as a missed deadline
+        """
+        self._spin = spin_s
+        self._deadline_tolerance = deadline_tolerance_s
+
+        self._pending = {}  # servo -> (angle, percent_speed, profile) of the next batch
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()  # held during a batch, run and start do not overlap
+        self._thread: Optional[threading.Thread] = None
+        self._missed_deadlines = 0
+
+    def add_move(self, servo: ServoController, angle: int, percent_speed: float, profile: str = "constant") -> None:
+        """
+        queue a move for the next batch. A second move for the same servo replaces the first one.
+        :param servo: controller to move
+        :param angle: position in degree
+        :param percent_speed: percentage of the maximum rotation speed
+        :param profile: speed profile of the move, see ServoController.go_to_position
+        """
+        if servo.streaming:
+            raise RuntimeError("the servo is in streaming mode, call stop_stream first")
+
+        with self._lock:
+            self._pending[servo] = (angle, percent_speed, profile)
+
+    def run(self, synchronize: bool = True) -> int:
+        """
+        run the queued moves and block until all of them are done, after the batch in progress if any.
+        A servo switched to streaming mode since its add_move raises RuntimeError, the moves are kept queued
+        :param synchronize: stretch the faster moves so that every servo reaches its position at the same time
+        :return: number of steps fired later than the deadline tolerance
+        """
+        with self._run_lock:
+            return self._run(synchronize)
+
+    def _run(self, synchronize: bool) -> int:
+        """ run the queued moves, the run lock is held """
+        with self._lock:
+            if any(servo.streaming for servo in self._pending):
+                raise RuntimeError("a servo is in streaming mode, call stop_stream first")
+            pending, self._pending = self._pending, {}
+
+        moves = [(servo, servo.plan_move(angle=angle, percent_speed=percent_speed, profile=profile))
+                 for servo, (angle, percent_speed, profile) in pending.items()]
+        if not moves:
+            return 0
+
+        # the steps are fired at absolute deadlines: only the overhead of the acquisition host is added
+        corrections = [servo.step_correction(absolute_deadlines=True) for servo, _ in moves]
+        scales = self._time_scales([trajectory for _, trajectory in moves], corrections, synchronize)
+
+        # one entry per servo: (time of the next step, index of the move, index of the step)
+        queue = [(0., index, 0) for index in range(len(moves))]
+        heapq.heapify(queue)
+        change_duties = [servo.change_duty for servo, _ in moves]
+        duties = [trajectory.duties for _, trajectory in moves]
+        waits = [trajectory.waits for _, trajectory in moves]
+
+        spin = self._spin
+        tolerance = self._deadline_tolerance
+        missed = 0
+        for servo, trajectory in moves:
+            servo.begin_move(trajectory)
+        start = monotonic()
+
+        while queue:
+            at, index, step = queue[0]
+            if sleep_until(start + at, spin) > tolerance:
+                missed += 1
+
+            change_duties[index](duties[index][step])
+
+            step += 1
+            if step < len(duties[index]):
+                heapq.heapreplace(queue, (at + (waits[index][step - 1] + corrections[index]) * scales[index],
+                                          index, step))
+            else:
+                heapq.heappop(queue)
+
+        elapsed = monotonic() - start
+        for servo, trajectory in moves:
+            servo.complete_move(trajectory, elapsed=elapsed)
+
+        self._missed_deadlines = missed
+        return missed
+
+    def start(self, synchronize: bool = True) -> None:
+        """ run the queued moves in the timing thread without blocking the caller, see run """
+        self.wait()
+        self._thread = threading.Thread(target=self.run, args=(synchronize,), daemon=True)
+        self._thread.start()
+
+    def wait(self) -> None:
+        """ block until the moves started with start are done """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def missed_deadlines(self) -> int:
+        """ number of steps fired too late during the last batch """
+        return self._missed_deadlines
+
+    @staticmethod
+    def _time_scales(trajectories: list, corrections: list, synchronize: bool) -> list:
+        """ factor applied to the corrected waiting times of each trajectory """
+        if not synchronize:
+            return [1.] * len(trajectories)
+
+        # every move applies its last value at the end of the longest move, keeping the shape of its profile
+        durations = [MotionEngine._duration(trajectory, correction)
+                     for trajectory, correction in zip(trajectories, corrections)]
+        duration = max(durations)
+
+        return [duration / move_duration if move_duration else 1. for move_duration in durations]
+
+    @staticmethod
+    def _duration(trajectory: Trajectory, correction: float) -> float:
+        """ time between the first and the last value of a trajectory """
+        return trajectory.duration - trajectory.waits[-1] + (len(trajectory.waits) - 1) * correction
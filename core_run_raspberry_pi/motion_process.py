@@ -0,0 +1,240 @@
+import gc
+import heapq
+import multiprocessing
+import struct
+import threading
+from multiprocessing import shared_memory
+from time import monotonic, sleep
+from typing import Callable, NamedTuple, Optional
+
+from motion_profiles import PROFILES
+from timing import sleep_until
+
+SEQ = struct.Struct("<Q")  # seqlock counter at the start of each slot, odd while the slot is written
+# running flag of the motion process, padded to 8 bytes
+HEADER = struct.Struct("<I4x")
+# command slot, written by the application: angle in degree, percent_speed, command id, profile index
+COMMAND = struct.Struct("<ddII")
+# state slot, written by the motion process: angle in degree, last command id done, moving flag, failed flag
+STATE = struct.Struct("<dIII")
+
+COMMAND_SLOT = SEQ.size + COMMAND.size
+STATE_SLOT = SEQ.size + STATE.size
+
+
+class MotionState(NamedTuple):
+    """ state of a servo published by the motion process """
+    angle: float  # last position reached in degree
+    command: int  # id of the last command done, 0 before the first one
+    moving: bool
+    failed: bool  # the last command done raised an error before its end, angle is then the one before the move
+
+
+def _write(buffer: memoryview, offset: int, layout: struct.Struct, *values) -> None:
+    """ write a slot: the counter is odd during the write, so a reader never keeps a torn value """
+    seq = SEQ.unpack_from(buffer, offset)[0]
+    SEQ.pack_into(buffer, offset, seq + 1)
+    layout.pack_into(buffer, offset + SEQ.size, *values)
+    SEQ.pack_into(buffer, offset, seq + 2)
+
+
+def _read(buffer: memoryview, offset: int, layout: struct.Struct) -> tuple:
+    """ read a slot, again while it is written """
+    while True:
+        seq = SEQ.unpack_from(buffer, offset)[0]
+        if seq & 1:
+            continue
+        values = layout.unpack_from(buffer, offset + SEQ.size)
+        if SEQ.unpack_from(buffer, offset)[0] == seq:
+            return values
+
+
+class MotionProcess:
+    """
+    Run the moves of several servos in a dedicated process, so the application never delays the steps:
+    no shared interpreter lock nor garbage collection pause, and no pickling of the commands.
+    A single scheduler thread fires the steps of every servo at absolute deadlines, as MotionEngine does.
+    The application and the motion process exchange fixed-size slots in shared memory, one command slot and one state
+    slot per servo, each with a seqlock and a single writer.
+    A command slot holds the last target: a target written during a move replaces the previous pending one,
+    the motion process goes to it once the current move is finished.
+    """
+
+    def __init__(self, servos: dict, backend: Optional[Callable] = None, poll_s: float = 0.0005,
+                 spin_s: float = 0.0002):
+        """
+        init function
+        :param servos: GPIO number -> servo config of params/servo_params.json
+        :param backend: PWMBackend class, instantiated in the motion process. RPi.GPIO by default
+        :param poll_s: maximum time between two reads of the command slots in seconds
+        :param spin_s: duration of the busy wait at the end of each deadline wait
+        """
+        self._pins = list(servos)
+        self._index = {pin: index for index, pin in enumerate(self._pins)}
+        self._servos = servos
+        self._backend = backend
+        self._poll = poll_s
+        self._spin = spin_s
+
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=HEADER.size + len(servos) * (COMMAND_SLOT + STATE_SLOT))
+        self._memory.buf[:] = bytes(self._memory.size)
+
+        self._commands = [0] * len(servos)  # id of the last command of each servo
+        self._lock = threading.Lock()  # single writer of the command slots
+        self._process = None
+
+    def start(self) -> None:
+        """ start the motion process, it initializes the servos """
+        HEADER.pack_into(self._memory.buf, 0, 1)
+        self._process = multiprocessing.Process(
+            target=_run_motion, args=(self._memory.name, self._servos, self._backend, self._poll, self._spin),
+            name="motion", daemon=True)
+        self._process.start()
+
+    def stop(self) -> None:
+        """ stop the motion process once its current moves are finished, and release the shared memory """
+        if self._process is not None:
+            HEADER.pack_into(self._memory.buf, 0, 0)
+            self._process.join()
+            self._process = None
+
+        self._memory.close()
+        self._memory.unlink()
+
+    def go_to_position(self, pin: int, angle: float, percent_speed: float, profile: str = "constant") -> int:
+        """
+        set the target of a servo, see ServoController.go_to_position. Returns at once
+        :return: id of the command, for wait
+        """
+        if profile not in PROFILES:
+            raise ValueError(f"unknown motion profile: {profile}")
+        self._check_alive()
+
+        index = self._index[pin]
+        with self._lock:
+            self._commands[index] += 1
+            command = self._commands[index]
+            _write(self._memory.buf, self._command_offset(index), COMMAND,
+                   angle, percent_speed, command, PROFILES.index(profile))
+        return command
+
+    def state(self, pin: int) -> MotionState:
+        """ state of a servo published by the motion process """
+        angle, command, moving, failed = _read(self._memory.buf, self._state_offset(self._index[pin]), STATE)
+        return MotionState(angle, command, bool(moving), bool(failed))
+
+    def wait(self, pin: int, command: int, timeout: Optional[float] = None) -> bool:
+        """
+        wait until a command is done, or replaced by a later one. See state for its result
+        :return: False if the timeout expired
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while self.state(pin).command < command:
+            self._check_alive()
+            if deadline is not None and monotonic() > deadline:
+                return False
+            sleep(self._poll)
+        return True
+
+    def _check_alive(self) -> None:
+        """ raise RuntimeError if the motion process is not running """
+        if self._process is None or not self._process.is_alive():
+            exitcode = None if self._process is None else self._process.exitcode
+            raise RuntimeError(f"the motion process is not running (exit code {exitcode})")
+
+    def _command_offset(self, index: int) -> int:
+        """ offset of the command slot of a servo """
+        return HEADER.size + index * (COMMAND_SLOT + STATE_SLOT)
+
+    def _state_offset(self, index: int) -> int:
+        """ offset of the state slot of a servo """
+        return self._command_offset(index) + COMMAND_SLOT
+
+
+def _run_motion(name: str, servos: dict, backend: Optional[Callable], poll_s: float, spin_s: float) -> None:
+    """ main function of the motion process: a single thread runs the moves written in the slots """
+    from servo_motor import ServoController
+
+    memory = shared_memory.SharedMemory(name=name)
+    buffer = memory.buf
+    pwm = backend() if backend is not None else None
+    controllers = [ServoController(signal_pin=pin, backend=pwm, **conf) for pin, conf in servos.items()]
+
+    # the objects created until now live for the whole process: out of the reach of the garbage collector
+    gc.freeze()
+
+    try:
+        _schedule(buffer, controllers, poll_s, spin_s)
+    finally:
+        for servo in controllers:
+            servo.release()
+        del buffer
+        memory.close()
+
+
+def _schedule(buffer: memoryview, controllers: list, poll_s: float, spin_s: float) -> None:
+    """
+    loop of the motion process, until the running flag is cleared.
+    The steps of the moves in progress are merged into one time-ordered queue, as in MotionEngine.run.
+    The command slots of the idle servos are read at least every poll_s
+    """
+    offsets = [HEADER.size + index * (COMMAND_SLOT + STATE_SLOT) for index in range(len(controllers))]
+    for servo, offset in zip(controllers, offsets):
+        _write(buffer, offset + COMMAND_SLOT, STATE, servo.current_angle, 0, 0, 0)
+
+    done = [0] * len(controllers)  # id of the last command done of each servo
+    moves = [None] * len(controllers)  # trajectory, command id, correction and start time of the move in progress
+    queue = []  # (time of the next step, index of the servo, index of the step)
+
+    while HEADER.unpack_from(buffer, 0)[0]:
+        now = monotonic()
+        for index, servo in enumerate(controllers):
+            if moves[index] is not None:
+                continue
+            angle, percent_speed, command, profile = _read(buffer, offsets[index], COMMAND)
+            if command == done[index]:
+                continue
+
+            try:
+                trajectory = servo.plan_move(angle=angle, percent_speed=percent_speed, profile=PROFILES[profile])
+                servo.begin_move(trajectory)
+            except Exception:
+                done[index] = command
+                _write(buffer, offsets[index] + COMMAND_SLOT, STATE, servo.current_angle, command, 0, 1)
+                continue
+
+            _write(buffer, offsets[index] + COMMAND_SLOT, STATE, servo.current_angle, done[index], 1, 0)
+            moves[index] = (trajectory, command, servo.step_correction(absolute_deadlines=True), now)
+            heapq.heappush(queue, (now, index, 0))
+
+        if not queue:
+            sleep(poll_s)
+            continue
+
+        at, index, step = queue[0]
+        if at - monotonic() > poll_s:
+            # read the command slots again before the next step
+            sleep(poll_s)
+            continue
+        sleep_until(at, spin_s)
+
+        servo = controllers[index]
+        trajectory, command, correction, start = moves[index]
+        try:
+            servo.change_duty(trajectory.duties[step])
+            failed = 0
+        except Exception:
+            failed = 1
+
+        step += 1
+        if step < len(trajectory.duties) and not failed:
+            heapq.heapreplace(queue, (at + trajectory.waits[step - 1] + correction, index, step))
+            continue
+
+        heapq.heappop(queue)
+        if not failed:
+            servo.complete_move(trajectory, elapsed=monotonic() - start)
+        moves[index] = None
+        done[index] = command
+        _write(buffer, offsets[index] + COMMAND_SLOT, STATE, servo.current_angle, command, 0, failed)
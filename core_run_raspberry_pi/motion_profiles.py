@@ -0,0 +1,43 @@
+import numpy as np
+
+PROFILES = ("constant", "trapezoid", "s_curve")
+
+
+def step_speeds(profile: str, positions: np.ndarray, max_speed: float, max_accel: float) -> np.ndarray:
+    """
+    average speed between consecutive positions of an acceleration-limited move that starts and ends at rest.
+    The move accelerates up to max_speed, cruises, then decelerates symmetrically. If it is too short to reach
+    max_speed, the peak speed is reduced.
+    :param profile: "trapezoid" (constant acceleration) or "s_curve" (sine-shaped acceleration, without jerk step)
+    :param positions: distances from the start in degree, increasing from 0, the last one is the length of the move
+    :param max_speed: cruise speed in degree/s
+    :param max_accel: maximum acceleration in degree/s²
+    :return: speed in degree/s between positions[i] and positions[i + 1]
+    """
+    if profile not in PROFILES[1:]:
+        raise ValueError(f"unknown motion profile: {profile}")
+
+    distance = positions[-1]
+    # for the same peak acceleration the sine-shaped ramp is pi / 2 longer than the constant one
+    ramp_factor = 1. if profile == "trapezoid" else np.pi / 2
+    speed = min(max_speed, np.sqrt(max_accel * distance / ramp_factor))
+    ramp_time = ramp_factor * speed / max_accel
+    ramp_distance = speed * ramp_time / 2
+    duration = 2 * ramp_time + (distance - 2 * ramp_distance) / speed
+
+    def ramp(position: np.ndarray) -> np.ndarray:
+        """ time to travel a distance from rest during the acceleration """
+        position = np.clip(position, 0., ramp_distance)
+        if profile == "trapezoid":
+            return np.sqrt(2 * position * ramp_time / speed)
+
+        grid = np.linspace(0., ramp_time, 1024)
+        travelled = speed / 2 * (grid - ramp_time / np.pi * np.sin(np.pi * grid / ramp_time))
+        return np.interp(position, travelled, grid)
+
+    times = np.where(
+        positions <= ramp_distance, ramp(positions),
+        np.where(positions >= distance - ramp_distance, duration - ramp(distance - positions),
+                 ramp_time + (positions - ramp_distance) / speed))
+
+    return np.diff(positions) / np.diff(times)
@@ -0,0 +1,113 @@
+from array import array
+from bisect import bisect_right
+from time import monotonic
+from typing import Callable, Optional
+
+
+class MotionStats:
+    """
+    Timing metrics of the moves run by ServoController.go_to_position.
+    The last moves are kept in fixed-size ring buffers, the step intervals in a histogram with fixed bins,
+    so the memory used does not grow with the number of moves.
+    """
+
+    def __init__(self, capacity: int = 256, export_hook: Optional[Callable[[dict], None]] = None,
+                 export_period_s: float = 10., overrun_tolerance_s: float = 0.0005):
+        """
+        init function
+        :param capacity: number of moves kept in the ring buffers
+        :param export_hook: called with the stats() snapshot every export_period_s, after a move
+        :param export_period_s: period of the export in seconds
+        :param overrun_tolerance_s: a step interval longer than the waiting time plus this tolerance is an overrun
+        """
+        self._capacity = capacity
+        self._export_hook = export_hook
+        self._export_period = export_period_s
+        self._last_export = monotonic()
+        self.overrun_tolerance = overrun_tolerance_s
+
+        self._commanded_times = array('d', bytes(8 * capacity))
+        self._actual_times = array('d', bytes(8 * capacity))
+        self._target_speeds = array('d', bytes(8 * capacity))
+        self._achieved_speeds = array('d', bytes(8 * capacity))
+        self._timed = array('b', bytes(capacity))  # the move has an achieved speed
+        self._duty_times = array('d', bytes(8 * capacity))  # mean time of a ChangeDutyCycle call of each move
+        self._overruns = array('q', bytes(8 * capacity))
+
+        # step interval bins: 4 per octave from 50 µs to about 1.6 s
+        self._interval_edges = [0.00005 * 2 ** (i / 4) for i in range(61)]
+        self._interval_counts = array('q', bytes(8 * (len(self._interval_edges) + 1)))
+
+        self._nb_moves = 0
+        self._nb_steps = 0
+        self._nb_overruns = 0
+        self._nb_untimed = 0
+
+    def record_interval(self, interval: float) -> None:
+        """ add the time between two steps to the histogram """
+        self._interval_counts[bisect_right(self._interval_edges, interval)] += 1
+
+    def record_move(self, commanded_time: float, actual_time: float, target_speed: float,
+                    achieved_speed: Optional[float], nb_steps: int, duty_time: float, overruns: int) -> None:
+        """
+        add a move to the ring buffers
+        :param commanded_time: duration of the move according to the waiting time, in seconds
+        :param actual_time: measured duration of the move in seconds
+        :param target_speed: speed asked with percent_speed in degree/s
+        :param achieved_speed: distance divided by the measured duration in degree/s. None for a move without
+            distance or in a single step: the move is counted but left out of the speed metrics
+        :param nb_steps: number of duty cycle values applied
+        :param duty_time: total time spent in ChangeDutyCycle in seconds
+        :param overruns: number of steps later than expected
+        """
+        index = self._nb_moves % self._capacity
+        self._commanded_times[index] = commanded_time
+        self._actual_times[index] = actual_time
+        self._target_speeds[index] = target_speed
+        self._achieved_speeds[index] = 0. if achieved_speed is None else achieved_speed
+        self._timed[index] = achieved_speed is not None
+        self._duty_times[index] = duty_time / nb_steps
+        self._overruns[index] = overruns
+
+        self._nb_moves += 1
+        self._nb_steps += nb_steps
+        self._nb_overruns += overruns
+        self._nb_untimed += achieved_speed is None
+
+        if self._export_hook is not None and monotonic() - self._last_export >= self._export_period:
+            self._last_export = monotonic()
+            self._export_hook(self.stats())
+
+    def stats(self) -> dict:
+        """ snapshot of the counters, of the last moves and of the step interval histogram """
+        size = min(self._nb_moves, self._capacity)
+
+        def mean(buffer: array) -> float:
+            return sum(buffer[:size]) / size if size else 0.
+
+        time_errors = [actual - commanded for actual, commanded in
+                       zip(self._actual_times[:size], self._commanded_times[:size])]
+        timed = [index for index in range(size) if self._timed[index]]
+        target_speeds = [self._target_speeds[index] for index in timed]
+        achieved_speeds = [self._achieved_speeds[index] for index in timed]
+        speed_errors = [self._achieved_speeds[index] - self._target_speeds[index] for index in timed]
+
+        return {
+            "moves": self._nb_moves,
+            "steps": self._nb_steps,
+            "overruns": self._nb_overruns,
+            "moves_without_speed": self._nb_untimed,
+            "last_moves": size,
+            "commanded_time_s": mean(self._commanded_times),
+            "actual_time_s": mean(self._actual_times),
+            "time_error_max_s": max(time_errors, default=0.),
+            "duty_call_time_s": mean(self._duty_times),
+            # the speeds of the moves without distance or in a single step are left out
+            "target_speed_d_s": sum(target_speeds) / len(timed) if timed else 0.,
+            "achieved_speed_d_s": sum(achieved_speeds) / len(timed) if timed else 0.,
+            "speed_error_max_d_s": max(speed_errors, key=abs, default=0.),
+            "step_intervals": {
+                "edges_s": list(self._interval_edges),
+                "counts": list(self._interval_counts),
+            },
+        }
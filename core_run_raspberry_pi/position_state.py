@@ -0,0 +1,50 @@
+import json
+import os
+import time
+from typing import Optional
+
+from atomic_file import atomic_open
+
+
+class PositionState:
+    """
+    Last commanded angle of a servo, persisted in a small json file per pin, so a restarted process
+    can resume from it instead of snapping the servo to the centre.
+    The file is marked as moving during a move: if the process stops in the middle, the angle is stale.
+    """
+
+    def __init__(self, directory: str, pin: int, max_age_s: Optional[float] = None):
+        """
+        init function
+        :param directory: folder of the state files, created if needed
+        :param pin: GPIO number of the servo
+        :param max_age_s: a state older than this is stale, no limit by default
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, f"servo_{pin}.json")
+        self._max_age = max_age_s
+
+    def load(self) -> Optional[tuple]:
+        """
+        read the saved state
+        :return: angle in degree and True if it can be trusted, None without a readable state
+        """
+        try:
+            with open(self._path) as infile:
+                state = json.load(infile)
+            angle = float(state["angle"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        stale = state.get("moving", True) or \
+            (self._max_age is not None and time.time() - state.get("time", 0.) > self._max_age)
+        return angle, not stale
+
+    def save(self, angle: float, moving: bool = False) -> None:
+        """
+        write the state atomically
+        :param angle: last commanded angle in degree
+        :param moving: a move to this angle is in progress
+        """
+        with atomic_open(self._path) as outfile:
+            json.dump({"angle": angle, "moving": moving, "time": time.time()}, outfile)
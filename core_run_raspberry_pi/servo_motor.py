@@ -1,14 +1,36 @@
-from time import sleep
-import RPi.GPIO as GPIO
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from time import monotonic, sleep
+from typing import NamedTuple, Optional
+
+from motion_stats import MotionStats
+from pwm_backend import PWMBackend, RPiGPIOBackend
+from servo_profiles import build_speed_index, build_speed_map
+from timing import sleep_until
+
+
+class Trajectory(NamedTuple):
+    """ compiled move: duty cycle values to apply and the waiting time after each of them """
+    duties: array
+    waits: array
+    waiting_time: float  # waiting time given by the speed model, the cruise one for a motion profile
+    step: int
+    angle: float  # end position in degree
+    duration: float  # sum of the waits
 
 
 class ServoController:
     """ core class to control a servo motor with any Raspberry Pi except the Pico"""
 
-    def __init__(self, signal_pin: int, **conf):
+    def __init__(self, signal_pin: int, backend: Optional[PWMBackend] = None, stats: Optional[MotionStats] = None,
+                 recorder=None, **conf):
         """
         init function
         :param signal_pin: GPIO number where the signal of the servo is plugged (yellow wire)
+        :param backend: PWM driver, RPi.GPIO by default
+        :param stats: timing metrics of go_to_position, disabled by default
+        :param recorder: TrajectoryRecorder of the setpoints applied, with the pin as servo id. Disabled by default
         :param freq: frequency of the PWM (Pulse Width Modulation) in Hz (50 by default)
         """
         period = conf.get("period_ms", 20)  # period of a duty cycle
@@ -18,7 +40,20 @@ class ServoController:
 
         self._min_speed = conf.get("min_speed_d_s", 7)  # min speed of the servo
         self._max_speed = conf.get("max_speed_d_s", 400)  # maximum speed of the servo
-        self._speed_config = conf.get("speed_config", {})
+        # precompiled by servo_profiles.load_profiles, or built from the speed config
+        self._speed_upper, self._speed_models = conf.get("speed_index") or \
+            build_speed_index(conf.get("speed_config", {}), self._min_speed, self._max_speed)
+        # dense table choosing the fewest steps per degree within speed_tolerance, None to use the index only
+        speed_map = conf.get("speed_map") if "speed_map" in conf else build_speed_map(
+            conf.get("speed_config", {}), (self._speed_upper, self._speed_models), self._min_speed, self._max_speed,
+            conf.get("speed_tolerance", 0.05), conf.get("speed_map_resolution_d_s", 0.5))
+        self._map_origin, self._map_resolution, self._map_models = speed_map or (0., 1., [])
+
+        # acceleration of the motion profiles: from the minimum to the maximum speed within accel_steps steps
+        # of the step size used at the maximum speed
+        step_fast = self._speed_model(self._max_speed)[0]
+        self._max_accel = conf.get("max_accel_d_s2") or \
+            (self._max_speed ** 2 - self._min_speed ** 2) / (2 * conf.get("accel_steps", 10) * self._max_angle / step_fast)
 
         self._percent_min = min_duty / period * 100
         self._percent_max = max_duty / period * 100
@@ -28,13 +63,76 @@ class ServoController:
 
         self._min_increment = (self._percent_max - self._percent_min) / self._max_angle
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(signal_pin, GPIO.OUT)
-        self._servo = GPIO.PWM(signal_pin, 1 / period * 1000)
+        # "sleep": wait between each step, "deadline": fire each step at an absolute time to avoid drift
+        self._scheduling = conf.get("scheduling", "sleep")
+        if self._scheduling not in ("sleep", "deadline"):
+            raise ValueError(f"unknown scheduling mode: {self._scheduling}")
+        self._spin = conf.get("spin_s", 0.0002)  # busy wait at the end of each deadline wait
+        self._deadline_tolerance = conf.get("deadline_tolerance_s", 0.0005)  # lateness counted as a miss
+        self._missed_deadlines = 0  # during the last move
+        self._total_missed_deadlines = 0
+
+        self._stats = stats
+
+        # time for the servo to physically finish a move, on top of the speed model
+        self._settle_margin = conf.get("settle_margin_s", 0.05)
+        self._settle_deadline = 0.
+
+        # loop latency compensation: the speed model includes the per-step overhead of the acquisition host,
+        # step_overhead_s estimated by create_speed_config.py. The overhead of this host is measured at the start,
+        # then tracked with an exponentially weighted moving average. Disabled without step_overhead_s
+        self._reference_overhead = conf.get("step_overhead_s")
+        self._overhead_smoothing = conf.get("overhead_smoothing", 0.1)
+        self._host_overhead = 0.
+
+        # streaming mode, see start_stream
+        self._stream_conf = {
+            "rate_hz": conf.get("stream_rate_hz", 100),  # duty cycle values applied per second
+            "capacity": conf.get("stream_capacity", 256),  # maximum number of pending setpoints
+            "policy": conf.get("stream_policy", "drop_oldest"),  # "drop_oldest", "coalesce" or "block"
+        }
+        self._stream = None
+
+        # compiled moves, keyed on (start angle, end angle, percent_speed, profile)
+        self._compile_move = lru_cache(maxsize=conf.get("trajectory_cache_size", 256))(self._build_trajectory)
+
+        # last commanded angle persisted per pin in state_dir, to resume from it after a restart.
+        # A stale state (process stopped during a move, or older than state_max_age_s) is ignored,
+        # unless state_resync is set: the servo then starts at the saved angle and goes slowly to the centre
+        self._state = None
+        saved = None
+        if conf.get("state_dir"):
+            from position_state import PositionState
+
+            self._state = PositionState(conf["state_dir"], signal_pin, max_age_s=conf.get("state_max_age_s"))
+            saved = self._state.load()
+        resync = saved is not None and not saved[1] and conf.get("state_resync", False)
+
+        self._backend = backend if backend is not None else RPiGPIOBackend()
+        self._servo = self._backend.pwm(signal_pin, 1 / period * 1000)
         self._current_angle = 0
-        self._servo.start((self._percent_max - self._percent_min) / 2 + self._percent_min)
+        if saved is not None and (saved[1] or resync):
+            self._current_angle = max(-self._max_angle / 2, min(self._max_angle / 2, saved[0]))
+        start_duty = self._angle_to_duty(self._current_angle)
+        self._servo.start(start_duty)
+        if self._reference_overhead is not None:
+            self._host_overhead = self._measure_overhead(start_duty, conf.get("overhead_probe_steps", 20))
+        if recorder is not None:
+            # wrapped after the overhead probe, which does not move the servo
+            self._servo = recorder.channel(self._servo, servo=signal_pin, duty_to_angle=self._duty_to_angle)
 
-    def go_to_position(self, angle: int, percent_speed: float) -> tuple:
+        if saved is not None and saved[1]:
+            # the servo already holds the saved angle
+            self._settle_deadline = monotonic()
+        else:
+            # the position before the start is unknown: the servo may have to rotate half of its range
+            self._update_settle(distance=self._max_angle / 2, elapsed=0.)
+
+        if resync:
+            self.wait_until_settled()
+            self.go_to_position(angle=0, percent_speed=conf.get("state_resync_percent_speed", 10))
+
+    def go_to_position(self, angle: int, percent_speed: float, profile: str = "constant") -> tuple:
         """
         To set the position of the servo in degrees, we have set up the position with 0 corresponding to the middle,
         positive angles to clockwise rotation, and negative angles to counterclockwise rotation.
@@ -42,46 +140,338 @@ class ServoController:
         will be 90 degrees, and the maximum position on the left will be -90 degrees.
         :param angle: position in degree
         :param percent_speed: percentage of the maximum rotation speed
+        :param profile: "constant" speed, or acceleration-limited "trapezoid" or "s_curve",
+            that start and stop smoothly and cruise at percent_speed
+        """
+        if self.streaming:
+            raise RuntimeError("the servo is in streaming mode, call stop_stream first")
+
+        trajectory = self.plan_move(angle=angle, percent_speed=percent_speed, profile=profile)
+        self.begin_move(trajectory)
+
+        start = monotonic()
+        if self._stats is not None:
+            self._run_instrumented(trajectory, percent_speed)
+        elif self._scheduling == "deadline":
+            self._run_deadline(trajectory)
+        else:
+            change_duty = self._servo.ChangeDutyCycle
+            correction = self.step_correction()
+            for duty, wait in zip(trajectory.duties, trajectory.waits):
+                change_duty(duty)
+                sleep(max(wait + correction, 0.))
+            self._track_overhead(trajectory, elapsed=monotonic() - start, correction=correction)
+
+        self.complete_move(trajectory, elapsed=monotonic() - start)
+        return trajectory.waiting_time, trajectory.step
+
+    async def go_to_position_async(self, angle: int, percent_speed: float, profile: str = "constant") -> tuple:
+        """
+        same as go_to_position but waits between the steps with asyncio instead of blocking the thread.
+        Each step is scheduled at an absolute time of the event loop so the waiting does not drift.
+        If the task is cancelled, the servo stays where it is and the current angle is the last one applied.
+        :param angle: position in degree
+        :param percent_speed: percentage of the maximum rotation speed
+        :param profile: speed profile of the move, see go_to_position
+        """
+        import asyncio
+
+        if self.streaming:
+            raise RuntimeError("the servo is in streaming mode, call stop_stream first")
+
+        trajectory = self.plan_move(angle=angle, percent_speed=percent_speed, profile=profile)
+        self.begin_move(trajectory)
+
+        loop = asyncio.get_running_loop()
+        change_duty = self._servo.ChangeDutyCycle
+        correction = self.step_correction(absolute_deadlines=True)
+
+        duty = None
+        start = deadline = loop.time()
+        try:
+            for duty, wait in zip(trajectory.duties, trajectory.waits):
+                change_duty(duty)
+                deadline += wait + correction
+                await asyncio.sleep(deadline - loop.time())
+        except asyncio.CancelledError:
+            if duty is not None:
+                angle = self._duty_to_angle(duty)
+                self._update_settle(distance=abs(angle - self._current_angle), elapsed=loop.time() - start)
+                self._current_angle = angle
+            self._save_state(self._current_angle)
+            raise
+
+        self.complete_move(trajectory, elapsed=loop.time() - start)
+        return trajectory.waiting_time, trajectory.step
+
+    def plan_move(self, angle: int, percent_speed: float, profile: str = "constant") -> Trajectory:
+        """
+        compile the move from the current position without running it, see go_to_position
+        :param angle: position in degree
+        :param percent_speed: percentage of the maximum rotation speed
+        :param profile: speed profile of the move
         """
         # range the value of angle between -90 and 90
         angle = max(-self._max_angle / 2, angle)
         angle = min(self._max_angle / 2, angle)
 
-        value_start = self._angle_to_duty(angle=self._current_angle)
-        value_end = self._angle_to_duty(angle=angle)
+        return self._compile_move(self._current_angle, angle, percent_speed, profile)
 
-        step_calc, waiting_time = self._get_variable_set(percent_speed)
-
-        steps = (self._max_duty - self._min_duty) / step_calc
-        increment = steps if value_end - value_start > 0 else -steps
+    def start_stream(self, percent_speed: float = 100., **stream_conf):
+        """
+        switch to streaming mode: the target angles pushed to the returned SetpointStream are applied
+        by a feeder thread at a fixed rate, without blocking the producer
+        :param percent_speed: percentage of the maximum rotation speed used to reach each setpoint
+        :param stream_conf: rate_hz, capacity and policy, overriding the stream_* values of the servo conf
+        """
+        from setpoint_stream import SetpointStream
 
-        if abs(increment) >= abs(angle - self._current_angle):
-            self._servo.ChangeDutyCycle(value_end)
-            self._current_angle = angle
-            return waiting_time, step_calc
+        self.stop_stream()
+        stream_conf = {**self._stream_conf, **stream_conf}
+        # the angle changes at each tick: it is saved when the stream stops
+        self._save_state(self._current_angle, moving=True)
+        max_step = self._percent_to_speed(percent_speed) / stream_conf["rate_hz"]
 
-        value_duty = value_start
+        self._stream = SetpointStream(self, max_step=max_step, spin_s=self._spin, **stream_conf)
+        self._stream.start()
+        return self._stream
 
-        in_loop = True
-        while in_loop:
-            self._servo.ChangeDutyCycle(value_duty)
-            value_duty += increment
-            if increment > 0:
-                in_loop = value_duty <= value_end
-            else:
-                in_loop = value_duty >= value_end
+    def stop_stream(self) -> None:
+        """ leave the streaming mode, the pending setpoints are discarded """
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream = None
+            self._save_state(self._current_angle)
 
-            if not in_loop:
-                self._servo.ChangeDutyCycle(value_end)
-            sleep(waiting_time)
+    def step_towards(self, angle: float, max_step: float) -> float:
+        """
+        apply a single duty cycle value towards a position, used by the streaming mode
+        :param angle: target position in degree
+        :param max_step: maximum rotation from the current position in degree
+        :return: position applied in degree
+        """
+        angle = max(-self._max_angle / 2, min(self._max_angle / 2, angle))
+        angle = max(self._current_angle - max_step, min(self._current_angle + max_step, angle))
 
+        self._servo.ChangeDutyCycle(self._angle_to_duty(angle))
+        self._update_settle(distance=abs(angle - self._current_angle), elapsed=0.)
         self._current_angle = angle
-        return waiting_time, step_calc
+
+        return angle
+
+    def change_duty(self, duty: float) -> None:
+        """ apply one duty cycle value of a trajectory """
+        self._servo.ChangeDutyCycle(duty)
+
+    def save_position(self, moving: bool = False) -> None:
+        """ persist the current angle, for the steps applied with step_towards outside the streaming mode """
+        self._save_state(self._current_angle, moving=moving)
+
+    def begin_move(self, trajectory: Trajectory) -> None:
+        """ record the start of a trajectory run outside go_to_position """
+        self._save_state(trajectory.angle, moving=True)
+
+    def complete_move(self, trajectory: Trajectory, elapsed: Optional[float] = None) -> None:
+        """
+        record the end of a trajectory run outside go_to_position
+        :param trajectory: trajectory applied
+        :param elapsed: time spent applying it in seconds, its nominal duration by default
+        """
+        if elapsed is None:
+            elapsed = trajectory.duration
+
+        self._update_settle(distance=abs(trajectory.angle - self._current_angle), elapsed=elapsed)
+        self._current_angle = trajectory.angle
+        self._save_state(trajectory.angle)
+
+    def estimate_move_time(self, angle: int, percent_speed: float, profile: str = "constant") -> float:
+        """
+        time in seconds for the servo to physically reach a position from the current one:
+        the duration of the steps, but at least the distance at the calibrated maximum speed, plus the settle margin
+        :param angle: position in degree
+        :param percent_speed: percentage of the maximum rotation speed
+        :param profile: speed profile of the move
+        """
+        trajectory = self.plan_move(angle=angle, percent_speed=percent_speed, profile=profile)
+        distance = abs(trajectory.angle - self._current_angle)
+        # with the latency compensation, each step lasts its waiting time plus the overhead of the acquisition host
+        duration = trajectory.duration + len(trajectory.duties) * (self._reference_overhead or 0.)
+
+        return max(duration, distance / self._max_speed) + self._settle_margin
+
+    def wait_until_settled(self) -> None:
+        """ wait until the servo has physically finished the last move, according to the speed model """
+        remaining = self._settle_deadline - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    async def wait_until_settled_async(self) -> None:
+        """ same as wait_until_settled without blocking the event loop """
+        import asyncio
+
+        remaining = self._settle_deadline - monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    def step_correction(self, absolute_deadlines: bool = False) -> float:
+        """
+        time in seconds to add to each waiting time of the speed model, so that the steps last as long as on the host
+        of the data acquisition: w_cmd = w_model + overhead of the acquisition host - overhead of this host
+        :param absolute_deadlines: the loop fires the steps at absolute deadlines, so its own overhead does not add up
+        """
+        if self._reference_overhead is None:
+            return 0.
+
+        return self._reference_overhead - (0. if absolute_deadlines else self._host_overhead)
+
+    @property
+    def step_overhead(self) -> float:
+        """ time in seconds spent by this host on each step on top of the waiting time, 0 without compensation """
+        return self._host_overhead
+
+    @property
+    def streaming(self) -> bool:
+        """ the servo is in streaming mode: its steps are applied by the feeder thread of the stream """
+        return self._stream is not None
+
+    @property
+    def current_angle(self) -> float:
+        """ last position reached in degree """
+        return self._current_angle
+
+    def stats(self) -> Optional[dict]:
+        """ snapshot of the timing metrics, None if they are disabled """
+        return None if self._stats is None else self._stats.stats()
+
+    @property
+    def missed_deadlines(self) -> int:
+        """ number of steps fired too late during the last move (deadline scheduling only) """
+        return self._missed_deadlines
+
+    @property
+    def total_missed_deadlines(self) -> int:
+        """ number of steps fired too late since the creation of the controller """
+        return self._total_missed_deadlines
 
     def release(self) -> None:
         """ release the PWM """
+        self.stop_stream()
         self._servo.stop()
-        GPIO.cleanup()
+        self._backend.cleanup()
+
+    def _update_settle(self, distance: float, elapsed: float) -> None:
+        """
+        estimate when the servo stops after a move: it cannot rotate faster than the calibrated maximum speed
+        :param distance: rotation in degree
+        :param elapsed: time already spent on the move in seconds
+        """
+        remaining = max(distance / self._max_speed - elapsed, 0.)
+        self._settle_deadline = monotonic() + remaining + self._settle_margin
+
+    def _save_state(self, angle: float, moving: bool = False) -> None:
+        """ persist the commanded angle, if the state file is enabled """
+        if self._state is not None:
+            self._state.save(angle, moving=moving)
+
+    def _measure_overhead(self, duty: float, nb_steps: int, probe_s: float = 0.001) -> float:
+        """
+        overhead of a step on this host: cost of ChangeDutyCycle and sleep overshoot
+        :param duty: duty cycle applied again at each step, so the servo does not move
+        :param nb_steps: number of steps measured
+        :param probe_s: waiting time of each step in seconds
+        """
+        change_duty = self._servo.ChangeDutyCycle
+        start = monotonic()
+        for _ in range(nb_steps):
+            change_duty(duty)
+            sleep(probe_s)
+
+        return max((monotonic() - start) / nb_steps - probe_s, 0.)
+
+    def _track_overhead(self, trajectory: Trajectory, elapsed: float, correction: float) -> None:
+        """
+        update the overhead of this host with a move run with sleeps
+        :param elapsed: time spent on the move in seconds
+        :param correction: correction applied to each waiting time during the move
+        """
+        nb_steps = len(trajectory.duties)
+        if self._reference_overhead is None or nb_steps < 2:
+            return
+
+        overhead = max((elapsed - trajectory.duration) / nb_steps - correction, 0.)
+        self._host_overhead += self._overhead_smoothing * (overhead - self._host_overhead)
+
+    def _run_deadline(self, trajectory: Trajectory) -> None:
+        """
+        apply each step of the trajectory at an absolute deadline, so the time spent in the loop body
+        and the sleep overshoot do not add up over the move
+        """
+        change_duty = self._servo.ChangeDutyCycle
+        spin = self._spin
+        tolerance = self._deadline_tolerance
+
+        correction = self.step_correction(absolute_deadlines=True)
+
+        missed = 0
+        deadline = monotonic()
+        for duty, wait in zip(trajectory.duties, trajectory.waits):
+            change_duty(duty)
+            deadline += wait + correction
+            if sleep_until(deadline, spin) > tolerance:
+                missed += 1
+
+        self._missed_deadlines = missed
+        self._total_missed_deadlines += missed
+
+    def _run_instrumented(self, trajectory: Trajectory, percent_speed: float) -> None:
+        """ same as the loops of go_to_position, with the measurement of the timing metrics """
+        stats = self._stats
+        record_interval = stats.record_interval
+        change_duty = self._servo.ChangeDutyCycle
+        deadline_mode = self._scheduling == "deadline"
+        spin = self._spin
+        overrun_tolerance = stats.overrun_tolerance
+        correction = self.step_correction(absolute_deadlines=deadline_mode)
+
+        overruns = 0
+        missed = 0
+        duty_time = 0.
+        previous_wait = None
+        start = previous = deadline = monotonic()
+        for duty, wait in zip(trajectory.duties, trajectory.waits):
+            before = monotonic()
+            change_duty(duty)
+            duty_time += monotonic() - before
+
+            if previous_wait is not None:
+                interval = before - previous
+                record_interval(interval)
+                if interval > previous_wait + correction + overrun_tolerance:
+                    overruns += 1
+            previous = before
+            previous_wait = wait
+
+            if deadline_mode:
+                deadline += wait + correction
+                if sleep_until(deadline, spin) > self._deadline_tolerance:
+                    missed += 1
+            else:
+                sleep(max(wait + correction, 0.))
+
+        actual_time = monotonic() - start
+        if deadline_mode:
+            self._missed_deadlines = missed
+            self._total_missed_deadlines += missed
+        else:
+            self._track_overhead(trajectory, elapsed=actual_time, correction=correction)
+
+        # a move without distance, or applied in a single step, has no meaningful speed
+        distance = abs(trajectory.angle - self._current_angle)
+        achieved_speed = distance / actual_time if distance and len(trajectory.duties) > 1 else None
+        stats.record_move(
+            commanded_time=trajectory.duration + len(trajectory.duties) * correction, actual_time=actual_time,
+            target_speed=self._percent_to_speed(percent_speed), achieved_speed=achieved_speed,
+            nb_steps=len(trajectory.duties), duty_time=duty_time, overruns=max(overruns, missed))
 
     def _angle_to_duty(self, angle: int) -> float:
         """ convert the angle to duty cycle """
@@ -89,19 +479,88 @@ class ServoController:
         return (self._percent_max - self._percent_min) - \
                (percent_duty * (self._percent_max - self._percent_min)) + self._percent_min
 
+    def _duty_to_angle(self, duty: float) -> float:
+        """ convert the duty cycle to angle, inverse of _angle_to_duty """
+        percent_duty = (self._percent_max - duty) / (self._percent_max - self._percent_min)
+        return percent_duty * self._max_angle - self._max_angle / 2
+
+    def _build_trajectory(self, start_angle: float, end_angle: float, percent_speed: float,
+                          profile: str) -> Trajectory:
+        """
+        compile a move into the list of duty cycle values to apply.
+        The last value is always the end position: the intermediate value that would be overwritten
+        immediately by the end position is skipped.
+        """
+        if profile != "constant":
+            from motion_profiles import PROFILES
+
+            if profile not in PROFILES:
+                raise ValueError(f"unknown motion profile: {profile}")
+
+        value_start = self._angle_to_duty(angle=start_angle)
+        value_end = self._angle_to_duty(angle=end_angle)
+
+        speed = self._percent_to_speed(percent_speed)
+        step_calc, param_a, param_b = self._speed_model(speed)
+        waiting_time = (param_a / (speed - param_b)) / 1000
+
+        steps = (self._max_duty - self._min_duty) / step_calc
+        increment = steps if value_end - value_start > 0 else -steps
+
+        if abs(increment) >= abs(end_angle - start_angle):
+            # the move is smaller than one step: go straight to the end position without waiting,
+            # the waiting time of the speed model is still returned by go_to_position
+            return Trajectory(array('d', [value_end]), array('d', [0.]), waiting_time, step_calc, end_angle, 0.)
+
+        nb_steps = int((value_end - value_start) / increment)
+        duties = array('d', (value_start + i * increment for i in range(nb_steps)))
+        duties.append(value_end)
+
+        if profile == "constant" or not nb_steps:
+            waits = array('d', [waiting_time]) * len(duties)
+        else:
+            waits = self._profile_waits(profile, nb_steps, step_calc, abs(end_angle - start_angle), speed,
+                                        param_a, param_b)
+
+        return Trajectory(duties, waits, waiting_time, step_calc, end_angle, sum(waits))
+
+    def _profile_waits(self, profile: str, nb_steps: int, step: int, distance: float, speed: float,
+                       param_a: float, param_b: float) -> array:
+        """
+        waiting time after each duty cycle value of an acceleration-limited move.
+        The speed of the profile between two values is converted to a waiting time with the speed model
+        of the step size, so the cruise waiting time is the one of a constant speed move
+        """
+        import numpy as np
+        from motion_profiles import step_speeds
+
+        positions = np.append(np.arange(nb_steps) * (self._max_angle / step), distance)
+        speeds = step_speeds(profile, positions, max_speed=speed, max_accel=self._max_accel)
+
+        waits = param_a / (np.maximum(speeds, self._min_speed) - param_b) / 1000
+        # the end position is followed by the waiting time of the last step, as for a constant speed
+        return array('d', np.append(waits, waits[-1]).tobytes())
+
     def _get_variable_set(self, percent_speed: float) -> tuple:
         """ calculate the best parameter set to rotate the servo at the desired speed """
-        percent_speed = min(100., percent_speed)
-        percent_speed = max(0., percent_speed)
+        speed = self._percent_to_speed(percent_speed)
+
+        step, param_a, param_b = self._speed_model(speed)
+        waiting_time = (param_a / (speed - param_b)) / 1000
 
-        speed = self._min_speed + percent_speed * (self._max_speed - self._min_speed) / 100
+        return step, waiting_time
 
-        for step, value in self._speed_config.items():
-            max_speed = value["max_speed"]
-            min_speed = value["min_speed"]
-            if min_speed <= speed <= max_speed:
-                params = value["params"]
+    def _speed_model(self, speed: float) -> tuple:
+        """ step size and parameters (a, b) of the speed model covering a speed in degree/s """
+        index = int((speed - self._map_origin) / self._map_resolution)
+        if 0 <= index < len(self._map_models):
+            return self._map_models[index]
 
-                waiting_time = (params[0] / (speed - params[1])) / 1000
+        return self._speed_models[bisect_left(self._speed_upper, speed)]
+
+    def _percent_to_speed(self, percent_speed: float) -> float:
+        """ rotation speed in degree/s for a percentage of the maximum rotation speed """
+        percent_speed = min(100., percent_speed)
+        percent_speed = max(0., percent_speed)
 
-                return int(step), waiting_time
+        return self._min_speed + percent_speed * (self._max_speed - self._min_speed) / 100
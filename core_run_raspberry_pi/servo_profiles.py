@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import pickle
+import warnings
+from bisect import bisect_left
+from typing import Optional
+
+from atomic_file import atomic_open
+
+CACHE_VERSION = 2
+
+
+def load_profiles(path: str) -> dict:
+    """
+    load the servo configs of a params json, validated and compiled with their speed lookup table.
+    The compiled form is cached in a pickle file next to the json and rebuilt when the hash of the json changes.
+    :param path: path of servo_params.json
+    :return: servo name -> conf of ServoController, with the extra keys speed_index and speed_map
+    """
+    with open(path, 'rb') as infile:
+        content = infile.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    path_cache = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.cache")
+    try:
+        with open(path_cache, 'rb') as infile:
+            cache = pickle.load(infile)
+        if cache["version"] == CACHE_VERSION and cache["hash"] == digest:
+            return cache["profiles"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    profiles = {name: compile_profile(name, conf) for name, conf in json.loads(content).items()}
+    _save_cache(path_cache, {"version": CACHE_VERSION, "hash": digest, "profiles": profiles})
+
+    return profiles
+
+
+def compile_profile(name: str, conf: dict) -> dict:
+    """
+    check a servo config and add its speed lookup tables
+    :param name: name of the servo, for the error messages
+    :param conf: servo config of the params json
+    """
+    if conf.get("period_ms", 20) <= 0:
+        raise ValueError(f"{name}: period_ms must be positive")
+    if conf.get("max_angle", 180) <= 0:
+        raise ValueError(f"{name}: max_angle must be positive")
+    if not 0 <= conf.get("min_duty_ms", 0.5) < conf.get("max_duty_ms", 2.5) <= conf.get("period_ms", 20):
+        raise ValueError(f"{name}: the duty cycle range must be within the period")
+
+    for step, value in conf.get("speed_config", {}).items():
+        if int(step) <= 0 or len(value["params"]) != 2 or not 0 < value["min_speed"] <= value["max_speed"]:
+            raise ValueError(f"{name}: invalid speed config for the step {step}")
+
+    speed_index = build_speed_index(conf.get("speed_config", {}), conf.get("min_speed_d_s", 7),
+                                    conf.get("max_speed_d_s", 400))
+    speed_map = build_speed_map(conf.get("speed_config", {}), speed_index, conf.get("min_speed_d_s", 7),
+                                conf.get("max_speed_d_s", 400), conf.get("speed_tolerance", 0.05),
+                                conf.get("speed_map_resolution_d_s", 0.5))
+
+    return {**conf, "speed_index": speed_index, "speed_map": speed_map}
+
+
+def build_speed_index(speed_config: dict, min_speed: float, max_speed: float) -> tuple:
+    """
+    compile the speed config into contiguous speed intervals sorted by speed, searchable with bisect.
+    Where the fitted ranges overlap, the first range of the config is used, as before.
+    A gap between two ranges is bridged with the model of the range below it, or of the range above it for a gap
+    before the first interval (below a range reduced to one speed), and the first and last ranges are extended
+    to cover [min_speed, max_speed].
+    :return: upper speed of each interval (the last one is infinite), (step, params) of each interval
+    """
+    if not speed_config:
+        raise ValueError("the servo config has no speed_config, run create_speed_config.py first")
+
+    ranges = [(value["min_speed"], value["max_speed"], int(step), *value["params"])
+              for step, value in speed_config.items()]
+    bounds = sorted({speed for range_ in ranges for speed in range_[:2]})
+
+    upper = []
+    models = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        middle = (low + high) / 2
+        model = next((range_[2:] for range_ in ranges if range_[0] <= middle <= range_[1]), None)
+        if model is None and models:
+            warnings.warn(f"no speed config between {low} and {high} degree/s, "
+                          f"the model of the range below is extended")
+            model = models[-1]
+        elif model is None:
+            warnings.warn(f"no speed config between {low} and {high} degree/s, "
+                          f"the model of the range above is extended")
+            model = min((range_ for range_ in ranges if range_[0] >= high), key=lambda range_: range_[0])[2:]
+
+        if models and models[-1] == model:
+            upper[-1] = high
+        else:
+            upper.append(high)
+            models.append(model)
+
+    if not models:
+        # a single range reduced to one speed
+        models.append(ranges[0][2:])
+        upper.append(bounds[0])
+
+    if min_speed < bounds[0] or max_speed > bounds[-1]:
+        warnings.warn(f"the speed config covers [{bounds[0]}, {bounds[-1]}] degree/s instead of "
+                      f"[{min_speed}, {max_speed}], the models are extended")
+
+    _, param_b = models[0][1:]
+    if min(min_speed, bounds[0]) <= param_b:
+        raise ValueError(f"the speed config cannot reach {min_speed} degree/s")
+
+    upper[-1] = float("inf")
+    return upper, models
+
+
+def build_speed_map(speed_config: dict, speed_index: tuple, min_speed: float, max_speed: float,
+                    tolerance: Optional[float], resolution: float) -> Optional[tuple]:
+    """
+    dense table of the speed model with the biggest increments, so the fewest ChangeDutyCycle calls and sleeps
+    per degree, for the speeds from min_speed to max_speed.
+    A step size is eligible for a cell when the whole cell is within its fitted speed range widened by the tolerance,
+    and its fit error relative to the speed is below the tolerance. Otherwise the cell keeps the model of the index.
+    :param speed_index: result of build_speed_index
+    :param tolerance: relative speed error accepted, None to disable the table
+    :param resolution: width of a cell in degree/s
+    :return: speed of the first cell, resolution, (step, param_a, param_b) of each cell
+    """
+    if tolerance is None:
+        return None
+
+    # the step is the number of increments for the whole angle range: the smallest one moves the most per wakeup
+    ranges = sorted((int(step), value["min_speed"], value["max_speed"], _parse_mae(value.get("mae")),
+                     *value["params"]) for step, value in speed_config.items())
+    upper, models = speed_index
+
+    cells = []
+    for index in range(int((max_speed - min_speed) / resolution) + 1):
+        low = min_speed + index * resolution
+        high = low + resolution
+        model = next(((step, param_a, param_b) for step, min_fit, max_fit, mae, param_a, param_b in ranges
+                      if min_fit * (1 - tolerance) <= low and high <= max_fit * (1 + tolerance)
+                      and mae <= tolerance * low and param_b < low), None)
+        cells.append(model or models[bisect_left(upper, (low + high) / 2)])
+
+    return min_speed, resolution, cells
+
+
+def _parse_mae(mae) -> float:
+    """ fit error of a speed config, saved as "0.7562 degree/s" by create_speed_config """
+    if mae is None:
+        return 0.
+    return float(str(mae).split()[0])
+
+
+def _save_cache(path: str, cache: dict) -> None:
+    """ write the cache atomically, a read-only params folder only disables the cache """
+    try:
+        with atomic_open(path, 'wb') as outfile:
+            pickle.dump(cache, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
@@ -0,0 +1,171 @@
+import threading
+from array import array
+from time import monotonic
+from typing import Iterable, Optional
+
+from timing import sleep_until
+
+POLICIES = ("drop_oldest", "coalesce", "block")
+
+
+class SetpointStream:
+    """
+    Bounded ring buffer of target angles drained by a feeder thread at a fixed rate.
+    At each tick the feeder takes the next setpoint and moves the servo towards it by one duty cycle value,
+    limited to the streaming speed. When the buffer is full, a push follows the overflow policy:
+    - "drop_oldest": the oldest setpoint is overwritten
+    - "coalesce": the pending setpoints are replaced by the new one, the servo goes straight to the latest target
+    - "block": the producer waits until there is room (backpressure)
+    """
+
+    def __init__(self, servo, rate_hz: float = 100., capacity: int = 256, policy: str = "drop_oldest",
+                 max_step: float = 1., spin_s: float = 0.0002):
+        """
+        init function
+        :param servo: ServoController to drive
+        :param rate_hz: number of duty cycle values applied per second
+        :param capacity: maximum number of pending setpoints
+        :param policy: behaviour of push when the buffer is full, see the class docstring
+        :param max_step: maximum rotation per tick in degree
+        :param spin_s: duration of the busy wait at the end of each tick
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        if capacity < 1:
+            raise ValueError("the capacity must be at least 1")
+
+        self._servo = servo
+        self._period = 1 / rate_hz
+        self._max_step = max_step
+        self._policy = policy
+        self._spin = spin_s
+
+        self._buffer = array('d', [0.]) * capacity
+        self._head = 0  # index of the oldest setpoint
+        self._count = 0
+        self._dropped = 0
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """ start the feeder thread """
+        self._stopped = False
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ stop the feeder thread, the pending setpoints are discarded """
+        with self._lock:
+            self._stopped = True
+            self._count = 0
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def push(self, angle: float, timeout: Optional[float] = None) -> bool:
+        """
+        add a target angle
+        :param angle: position in degree
+        :param timeout: maximum wait in seconds with the "block" policy, no limit by default
+        :return: False if the setpoint was not added (stream stopped or timeout)
+        """
+        return self.push_many((angle,), timeout=timeout) == 1
+
+    def push_many(self, angles: Iterable[float], timeout: Optional[float] = None) -> int:
+        """
+        add a batch of target angles under a single lock
+        :param angles: positions in degree, in order
+        :param timeout: maximum wait in seconds for each setpoint with the "block" policy, no limit by default
+        :return: number of setpoints added
+        """
+        buffer = self._buffer
+        capacity = len(buffer)
+        added = 0
+        with self._lock:
+            for angle in angles:
+                if self._stopped:
+                    break
+
+                if self._count == capacity:
+                    if self._policy == "drop_oldest":
+                        self._head = (self._head + 1) % capacity
+                        self._count -= 1
+                        self._dropped += 1
+                    elif self._policy == "coalesce":
+                        self._dropped += self._count
+                        self._count = 0
+                    elif not self._wait_not_full(timeout):
+                        break
+
+                buffer[(self._head + self._count) % capacity] = angle
+                self._count += 1
+                added += 1
+
+            if added:
+                self._not_empty.notify()
+
+        return added
+
+    def _wait_not_full(self, timeout: Optional[float]) -> bool:
+        """ backpressure: wait for the feeder to free a slot, the lock must be held. False on timeout or stop """
+        # wake the feeder first, it may be waiting for the setpoints of this batch
+        self._not_empty.notify()
+        return self._not_full.wait_for(lambda: self._count < len(self._buffer) or self._stopped, timeout) \
+            and not self._stopped
+
+    @property
+    def pending(self) -> int:
+        """ number of setpoints waiting in the buffer """
+        return self._count
+
+    @property
+    def dropped(self) -> int:
+        """ number of setpoints discarded by the overflow policy """
+        return self._dropped
+
+    def _pop(self, target: Optional[float]) -> Optional[float]:
+        """
+        next target of the feeder: the oldest setpoint, or the current target if the buffer is empty.
+        Wait for a setpoint if there is nothing left to do.
+        :return: None when the stream is stopped
+        """
+        with self._lock:
+            if not self._count:
+                if target is not None and target != self._servo.current_angle:
+                    return target
+                self._not_empty.wait_for(lambda: self._count or self._stopped)
+            if self._stopped:
+                return None
+
+            target = self._buffer[self._head]
+            self._head = (self._head + 1) % len(self._buffer)
+            self._count -= 1
+            self._not_full.notify()
+
+        return target
+
+    def _feed(self) -> None:
+        """ loop of the feeder thread """
+        step_towards = self._servo.step_towards
+        target = None
+        deadline = monotonic()
+        while True:
+            was_idle = target is None or target == self._servo.current_angle
+            target = self._pop(target)
+            if target is None:
+                return
+
+            if was_idle:
+                # restart the clock after a wait for a setpoint, instead of catching up the idle ticks
+                deadline = monotonic()
+
+            step_towards(target, self._max_step)
+            deadline += self._period
+            sleep_until(deadline, self._spin)
@@ -0,0 +1,20 @@
+from time import monotonic, sleep
+
+
+def sleep_until(deadline: float, spin_s: float = 0.0002) -> float:
+    """
+    wait until the monotonic clock reaches an absolute deadline.
+    Most of the wait is a regular sleep, the last spin_s seconds are a busy wait to absorb the sleep overshoot.
+    :param deadline: absolute time in seconds, on the time.monotonic clock
+    :param spin_s: duration of the final busy wait in seconds
+    :return: how late the deadline was reached in seconds (0 if on time)
+    """
+    remaining = deadline - monotonic()
+    if remaining > spin_s:
+        sleep(remaining - spin_s)
+
+    now = monotonic()
+    while now < deadline:
+        now = monotonic()
+
+    return now - deadline
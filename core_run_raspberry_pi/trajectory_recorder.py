@@ -0,0 +1,178 @@
+import mmap
+import struct
+import threading
+from math import inf
+from time import monotonic, monotonic_ns
+from typing import Callable
+
+from timing import sleep_until
+
+MAGIC = b"SVTR"
+VERSION = 1
+# padded to the size of a record, so the records stay aligned in the memory-mapped file
+HEADER = struct.Struct("<4sH10x")
+# monotonic time in ns, servo id, angle in degree
+RECORD = struct.Struct("<qH2xf")
+
+
+class RecordingPWM:
+    """ PWM channel that records the angle of each duty cycle value applied, the other calls are forwarded """
+
+    def __init__(self, channel, recorder: "TrajectoryRecorder", servo: int, duty_to_angle: Callable[[float], float]):
+        """
+        init function
+        :param channel: PWM channel of the servo
+        :param recorder: file of the records
+        :param servo: id of the servo in the records
+        :param duty_to_angle: conversion of a duty cycle value to an angle in degree
+        """
+        self._channel = channel
+        self._record = recorder.record
+        self._servo = servo
+        self._duty_to_angle = duty_to_angle
+
+    def ChangeDutyCycle(self, duty: float) -> None:
+        """ apply a duty cycle value and record it """
+        self._channel.ChangeDutyCycle(duty)
+        self._record(self._servo, self._duty_to_angle(duty))
+
+    def __getattr__(self, name: str):
+        return getattr(self._channel, name)
+
+
+class TrajectoryRecorder:
+    """
+    Record of the setpoints applied by one or more servos, to replay them with TrajectoryPlayer.
+    The file is a header then fixed 16-byte records (monotonic time in ns, servo id, angle as float32).
+    The records are buffered and written once the buffer is full, several servos can record from their own thread.
+    """
+
+    def __init__(self, path: str, capacity: int = 4096):
+        """
+        init function
+        :param path: binary file of the records, started over
+        :param capacity: number of records kept in memory before writing them
+        """
+        self._capacity = capacity
+        self._buffer = bytearray(capacity * RECORD.size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+
+    def channel(self, channel, servo: int, duty_to_angle: Callable[[float], float]) -> RecordingPWM:
+        """ wrap the PWM channel of a servo to record its setpoints, see RecordingPWM """
+        return RecordingPWM(channel, self, servo, duty_to_angle)
+
+    def record(self, servo: int, angle: float) -> None:
+        """ add a setpoint applied now """
+        time_ns = monotonic_ns()
+        with self._lock:
+            RECORD.pack_into(self._buffer, self._size * RECORD.size, time_ns, servo, angle)
+            self._size += 1
+            if self._size == self._capacity:
+                self._flush()
+
+    def flush(self) -> None:
+        """ write the buffered records """
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ write the remaining records and close the file """
+        self.flush()
+        self._file.close()
+
+    def _flush(self) -> None:
+        """ write the buffered records, the lock is held """
+        self._file.write(memoryview(self._buffer)[:self._size * RECORD.size])
+        self._file.flush()
+        self._size = 0
+
+
+class TrajectoryPlayer:
+    """
+    Replay of a file written by TrajectoryRecorder.
+    The file is memory-mapped and read record by record, so a long sequence is never loaded in memory.
+    Each setpoint is applied at its recorded time relative to the first record, with deadline timing.
+    """
+
+    def __init__(self, path: str):
+        """
+        init function
+        :param path: binary file of the records
+        """
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self._map) if len(self._map) >= HEADER.size else (None, None)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a trajectory record")
+
+        # a record partially written when the recorder was interrupted is ignored
+        self._size = (len(self._map) - HEADER.size) // RECORD.size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def duration(self) -> float:
+        """ time between the first and the last setpoint in seconds """
+        if not self._size:
+            return 0.
+        return (self._time_ns(self._size - 1) - self._time_ns(0)) / 10 ** 9
+
+    def first_angles(self) -> dict:
+        """ servo id -> angle of its first setpoint in degree, where to put the servo before the replay """
+        angles = {}
+        for offset in range(HEADER.size, HEADER.size + self._size * RECORD.size, RECORD.size):
+            _, servo, angle = RECORD.unpack_from(self._map, offset)
+            angles.setdefault(servo, angle)
+        return angles
+
+    def play(self, servos: dict, speed: float = 1., spin_s: float = 0.0002, tolerance_s: float = 0.0005) -> int:
+        """
+        apply every setpoint at its time, the servos are expected at their first angle
+        :param servos: servo id -> ServoController, the setpoints of the other servos are skipped
+        :param speed: replay speed factor, 2 plays twice as fast
+        :param spin_s: busy wait at the end of each deadline wait in seconds, see timing.sleep_until
+        :param tolerance_s: a setpoint applied later than this is counted as a missed deadline
+        :return: number of missed deadlines
+        """
+        if not self._size:
+            return 0
+
+        steps = {servo_id: servo.step_towards for servo_id, servo in servos.items()}
+        for servo in servos.values():
+            servo.save_position(moving=True)
+
+        missed = 0
+        unpack_from = RECORD.unpack_from
+        first_ns = self._time_ns(0)
+        scale = 1 / (10 ** 9 * speed)
+        start = monotonic()
+        try:
+            for offset in range(HEADER.size, HEADER.size + self._size * RECORD.size, RECORD.size):
+                time_ns, servo_id, angle = unpack_from(self._map, offset)
+                step = steps.get(servo_id)
+                if step is None:
+                    continue
+
+                if sleep_until(start + (time_ns - first_ns) * scale, spin_s) > tolerance_s:
+                    missed += 1
+                step(angle, inf)
+        finally:
+            for servo in servos.values():
+                servo.save_position()
+
+        return missed
+
+    def close(self) -> None:
+        """ unmap and close the file """
+        self._map.close()
+        self._file.close()
+
+    def _time_ns(self, index: int) -> int:
+        """ time of a record in ns """
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)[0]